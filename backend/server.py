@@ -1,26 +1,326 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, Query, Response, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from pymongo import IndexModel, ASCENDING, TEXT, ReturnDocument, UpdateOne, DeleteOne, ReplaceOne
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError
 import os
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, List, Optional, Union
 import uuid
-from datetime import datetime
+import time
+import json
+import base64
+import csv
+import io
+import codecs
+import hashlib
+import hmac
+import math
+import random
+import re
+import contextvars
+from collections import OrderedDict
+from urllib.parse import quote
+from datetime import datetime, timedelta, timezone
 import jwt
 import bcrypt
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+# By method only: the route is not known until the router has run
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served", ["method"], multiprocess_mode="livesum")
+MONGO_OPERATION_SECONDS = Histogram(
+    "mongo_operation_duration_seconds", "MongoDB operation latency", ["collection", "operation"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+MONGO_OPERATION_ERRORS = Counter("mongo_operation_errors_total", "Failed MongoDB operations", ["collection", "operation"])
+BCRYPT_SECONDS = Histogram(
+    "bcrypt_duration_seconds", "Password hash/verify time including pool queueing", ["operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+BCRYPT_REJECTED = Counter("bcrypt_rejected_total", "Password operations rejected because the pool queue was full")
+USER_CACHE_LOOKUPS = Counter("user_cache_lookups_total", "Authenticated principal cache lookups", ["result"])
+LOGIN_RATE_LIMITED = Counter("login_rate_limited_total", "Login attempts rejected by the rate limiter", ["scope"])
+RESPONSE_CACHE_LOOKUPS = Counter("response_cache_lookups_total", "Rendered response cache lookups", ["result"])
+
+def metrics_registry():
+    # With several worker processes each one writes to PROMETHEUS_MULTIPROC_DIR and the scrape merges them
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+# Slow query profiler configuration
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+QUERY_EXPLAIN_SAMPLE_RATE = float(os.environ.get('QUERY_EXPLAIN_SAMPLE_RATE', 0.01))
+QUERY_EXPLAIN_INTERVAL = float(os.environ.get('QUERY_EXPLAIN_INTERVAL', 300))
+QUERY_PROFILER_MAX_SHAPES = 1000
+
+# ASGI scope of the request being served, set by MetricsMiddleware; the router adds the matched route to it
+current_scope = contextvars.ContextVar("current_scope", default=None)
+
+def query_shape(value):
+    """Replaces literal values with 1 so queries differing only in values share a shape."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list) and any(isinstance(item, dict) for item in value):
+        return [query_shape(item) for item in value]
+    return 1
+
+def plan_stages(plan: dict) -> List[str]:
+    stages = [plan.get("stage", "?")]
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            stages += plan_stages(child)
+    return stages
+
+class QueryProfiler:
+    """Aggregates latency per query shape and samples explain() to flag collection scans."""
+
+    def __init__(self, slow_ms: float, sample_rate: float, explain_interval: float, max_shapes: int):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.explain_interval = explain_interval
+        self.max_shapes = max_shapes
+        self.shapes = OrderedDict()
+        self.explain_tasks = set()
+
+    def record(self, collection, operation: str, query: Optional[dict], elapsed: float):
+        scope = current_scope.get()
+        route = f"{scope['method']} {route_template(scope)}" if scope else None
+        shape = query_shape(query or {})
+        key = (collection.name, operation, json.dumps(shape, sort_keys=True))
+        stats = self.shapes.get(key)
+        if stats is None:
+            stats = self.shapes[key] = {
+                "collection": collection.name,
+                "operation": operation,
+                "shape": shape,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "route": None,
+                "plan": None,
+                "collscan": None,
+                "explained_at": None
+            }
+            while len(self.shapes) > self.max_shapes:
+                self.shapes.popitem(last=False)
+        self.shapes.move_to_end(key)
+        
+        elapsed_ms = elapsed * 1000
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        stats["route"] = route or stats["route"]
+        if elapsed_ms >= self.slow_ms:
+            logger.warning(f"Slow query {collection.name}.{operation} {key[2]} took {elapsed_ms:.1f}ms (route: {route})")
+        
+        due = stats["explained_at"] is None or time.monotonic() - stats["explained_at"] >= self.explain_interval
+        if query is not None and due and random.random() < self.sample_rate:
+            stats["explained_at"] = time.monotonic()
+            # Explain off the request path; keep a reference so the task is not garbage collected
+            task = asyncio.create_task(self.explain(collection, query, stats, route))
+            self.explain_tasks.add(task)
+            task.add_done_callback(self.explain_tasks.discard)
+
+    async def explain(self, collection, query: dict, stats: dict, route: Optional[str]):
+        try:
+            explanation = await collection.find(query).explain()
+        except Exception as e:
+            logger.debug(f"explain() failed for {collection.name}: {e}")
+            return
+        stages = plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        stats["plan"] = " <- ".join(stages)
+        stats["collscan"] = "COLLSCAN" in stages
+        if stats["collscan"]:
+            logger.warning(f"COLLSCAN on {collection.name}.{stats['operation']} {json.dumps(stats['shape'], sort_keys=True)} (route: {route})")
+
+    def top(self, limit: int) -> List[dict]:
+        ranked = sorted(self.shapes.values(), key=lambda stats: stats["max_ms"], reverse=True)[:limit]
+        return [
+            {
+                **{key: value for key, value in stats.items() if key != "explained_at"},
+                "avg_ms": round(stats["total_ms"] / stats["count"], 3),
+                "total_ms": round(stats["total_ms"], 3),
+                "max_ms": round(stats["max_ms"], 3)
+            }
+            for stats in ranked
+        ]
+
+query_profiler = QueryProfiler(SLOW_QUERY_MS, QUERY_EXPLAIN_SAMPLE_RATE, QUERY_EXPLAIN_INTERVAL, QUERY_PROFILER_MAX_SHAPES)
+
+def operation_filter(operation: str, args, kwargs) -> Optional[dict]:
+    # The query filter of filter-based operations; inserts, bulk writes and index calls have none
+    if operation in FILTER_OPERATIONS:
+        query = args[0] if args else kwargs.get("filter")
+        return query if isinstance(query, dict) else {}
+    if operation == "aggregate":
+        pipeline = args[0] if args else kwargs.get("pipeline", [])
+        if pipeline and "$match" in pipeline[0]:
+            return pipeline[0]["$match"]
+        return {}
+    return None
+
+# Motor methods that return a result directly (timed as one operation)
+TIMED_OPERATIONS = {
+    "find_one", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "find_one_and_update", "find_one_and_delete", "find_one_and_replace",
+    "count_documents", "estimated_document_count", "distinct", "bulk_write",
+    "create_indexes", "index_information"
+}
+# Motor methods that return a cursor (timed across the whole fetch)
+CURSOR_OPERATIONS = {"find", "aggregate"}
+# Operations whose first argument is a query filter
+FILTER_OPERATIONS = {
+    "find", "find_one", "update_one", "update_many", "replace_one", "delete_one", "delete_many",
+    "find_one_and_update", "find_one_and_delete", "find_one_and_replace", "count_documents"
+}
+
+class InstrumentedCursor:
+    """Wraps a Motor cursor; records the total fetch time once the results are consumed."""
+
+    def __init__(self, cursor, collection, operation: str, query: Optional[dict]):
+        self._cursor = cursor
+        self._collection = collection
+        self._operation = operation
+        self._query = query
+        self._elapsed = 0.0
+
+    def _observe(self, elapsed: float):
+        MONGO_OPERATION_SECONDS.labels(self._collection.name, self._operation).observe(elapsed)
+        query_profiler.record(self._collection, self._operation, self._query, elapsed)
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+        
+        def chain(*args, **kwargs):
+            # Keep the wrapper across sort()/limit()/batch_size() chaining
+            result = attr(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chain
+
+    async def to_list(self, length):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.to_list(length)
+        except Exception:
+            MONGO_OPERATION_ERRORS.labels(self._collection.name, self._operation).inc()
+            raise
+        finally:
+            self._observe(time.perf_counter() - started)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.__anext__()
+        except StopAsyncIteration:
+            self._elapsed += time.perf_counter() - started
+            self._observe(self._elapsed)
+            raise
+        except Exception:
+            MONGO_OPERATION_ERRORS.labels(self._collection.name, self._operation).inc()
+            raise
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+class InstrumentedCollection:
+    """Times every Motor operation on a collection, labelled by collection and operation."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if name in TIMED_OPERATIONS:
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await attr(*args, **kwargs)
+                except Exception:
+                    MONGO_OPERATION_ERRORS.labels(self.name, name).inc()
+                    raise
+                finally:
+                    elapsed = time.perf_counter() - started
+                    MONGO_OPERATION_SECONDS.labels(self.name, name).observe(elapsed)
+                    query = operation_filter(name, args, kwargs)
+                    if query is not None:
+                        query_profiler.record(self.collection, name, query, elapsed)
+            return timed
+        if name in CURSOR_OPERATIONS:
+            def cursor(*args, **kwargs):
+                return InstrumentedCursor(attr(*args, **kwargs), self.collection, name, operation_filter(name, args, kwargs))
+            return cursor
+        return attr
+
+class InstrumentedDatabase:
+    """Database proxy handing out InstrumentedCollection wrappers for db.<name> and db[name]."""
+
+    def __init__(self, database=None):
+        self.database = database
+        self.collections = {}
+
+    def bind(self, database):
+        self.database = database
+        self.collections = {}
+
+    def __getitem__(self, name):
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = self.collections[name] = InstrumentedCollection(self.database[name])
+        return collection
+
+    def __getattr__(self, name):
+        attr = getattr(self.database, name)
+        if hasattr(attr, "find_one"):
+            return self[name]
+        return attr
+
 # MongoDB connection
+# The client is opened per worker at startup (connect_db) rather than at import time,
+# so a server that forks workers after importing the app never shares a Motor client
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = None
+db = InstrumentedDatabase()
+attachments_bucket = None
+
+def connect_db(mongo_client=None):
+    global client, attachments_bucket
+    client = mongo_client or AsyncIOMotorClient(mongo_url)
+    db.bind(client[os.environ['DB_NAME']])
+    attachments_bucket = None
+
+def get_attachments_bucket():
+    global attachments_bucket
+    if attachments_bucket is None:
+        attachments_bucket = AsyncIOMotorGridFSBucket(db.database, bucket_name="attachments")
+    return attachments_bucket
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -33,6 +333,103 @@ JWT_SECRET = "medical_equipment_secret_key"
 JWT_ALGORITHM = "HS256"
 security = HTTPBearer()
 
+# Password hashing pool configuration
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 2))
+BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', 64))
+BCRYPT_POOL = os.environ.get('BCRYPT_POOL', 'thread')  # thread, process
+
+# Login rate limiting configuration
+LOGIN_RATE_LIMIT_BACKEND = os.environ.get('LOGIN_RATE_LIMIT_BACKEND', 'memory')  # memory, mongo
+# Per client address; clients behind one NAT share a bucket, so keep room for a shift change logging in together
+LOGIN_IP_LIMIT = int(os.environ.get('LOGIN_IP_LIMIT', 120))
+LOGIN_IP_WINDOW = float(os.environ.get('LOGIN_IP_WINDOW', 60))
+LOGIN_USERNAME_FAILURES = int(os.environ.get('LOGIN_USERNAME_FAILURES', 5))
+LOGIN_USERNAME_WINDOW = float(os.environ.get('LOGIN_USERNAME_WINDOW', 900))
+RATE_LIMIT_SHARDS = 16
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+# Peers whose X-Real-IP / X-Forwarded-For headers are believed (the bundled nginx)
+TRUSTED_PROXIES = {ip.strip() for ip in os.environ.get('TRUSTED_PROXIES', '127.0.0.1,::1').split(',') if ip.strip()}
+
+# Authenticated principal cache configuration
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+TRUST_TOKEN_ROLE = os.environ.get('TRUST_TOKEN_ROLE', 'false').lower() == 'true'
+
+# Response cache configuration
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Invalidation is per worker, so the TTL bounds how stale another worker's copy can get
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 30))
+RESPONSE_CACHE_HEADERS = ("X-Next-Cursor",)
+
+# Batch ticket update configuration
+TICKET_BATCH_MAX_ITEMS = int(os.environ.get('TICKET_BATCH_MAX_ITEMS', 500))
+
+# Label lookup configuration
+EQUIPMENT_LOOKUP_CACHE_SIZE = int(os.environ.get('EQUIPMENT_LOOKUP_CACHE_SIZE', 2048))
+EQUIPMENT_LOOKUP_CACHE_TTL = float(os.environ.get('EQUIPMENT_LOOKUP_CACHE_TTL', 30))
+EQUIPMENT_LOOKUP_MAX_CODES = 200
+QR_PAYLOAD_PREFIX = "EQP"
+
+# Pagination configuration
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+LEGACY_LIST_LIMIT = 1000
+
+# Delta sync configuration
+SYNC_BATCH_SIZE = int(os.environ.get('SYNC_BATCH_SIZE', 200))
+# The next window starts this far before the last one ended, so writes still in flight
+# when a window closed are picked up again; clients apply records idempotently by id
+SYNC_OVERLAP_SECONDS = float(os.environ.get('SYNC_OVERLAP_SECONDS', 5))
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 30))
+
+# Preventive maintenance scheduler configuration
+MAINTENANCE_SCHEDULER_ENABLED = os.environ.get('MAINTENANCE_SCHEDULER_ENABLED', 'true').lower() == 'true'
+MAINTENANCE_SCHEDULER_INTERVAL = float(os.environ.get('MAINTENANCE_SCHEDULER_INTERVAL', 60))
+MAINTENANCE_TICKET_BATCH_SIZE = int(os.environ.get('MAINTENANCE_TICKET_BATCH_SIZE', 100))
+SCHEDULER_USER_ID = "system"  # created_by of generated tickets, so only admins see them
+
+# Reporting configuration
+REPORT_DEFAULT_MONTHS = 12
+REPORT_MAX_MONTHS = 120
+# A month's partial aggregates are kept once it has been over this long
+REPORT_CLOSE_GRACE = timedelta(hours=1)
+
+# Index provisioning configuration
+ENSURE_INDEXES_ON_STARTUP = os.environ.get('ENSURE_INDEXES_ON_STARTUP', 'true').lower() == 'true'
+
+# Dashboard counters configuration
+STATS_RECOUNT_INTERVAL = float(os.environ.get('STATS_RECOUNT_INTERVAL', 300))
+
+# Bulk import/export configuration
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+IMPORT_MAX_REPORTED_ERRORS = 1000
+EXPORT_BATCH_SIZE = 500
+
+# Attachment configuration
+MAX_ATTACHMENT_SIZE = int(os.environ.get('MAX_ATTACHMENT_SIZE', 500 * 1024 * 1024))
+ATTACHMENT_READ_SIZE = 255 * 1024  # matches the GridFS default chunk size
+
+# Change event push configuration
+EVENT_SOURCE = os.environ.get('EVENT_SOURCE', 'local')  # local, change_stream
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', 100))
+EVENT_TOPICS = {"equipment", "tickets"}
+BACKEND_WORKERS = int(os.environ.get('BACKEND_WORKERS', 1))  # exported by entrypoint.sh
+
+# Change log configuration
+CHANGE_LOG_FLUSH_INTERVAL = float(os.environ.get('CHANGE_LOG_FLUSH_INTERVAL', 0.5))
+CHANGE_LOG_BATCH_SIZE = int(os.environ.get('CHANGE_LOG_BATCH_SIZE', 500))
+CHANGE_LOG_SNAPSHOT_EVERY = int(os.environ.get('CHANGE_LOG_SNAPSHOT_EVERY', 50))
+CHANGE_LOG_MAX_PENDING = 100000
+
+# Archive configuration
+# Removed equipment stays in the hot collections this long before it is archived
+ARCHIVE_AFTER_DAYS = float(os.environ.get('ARCHIVE_AFTER_DAYS', 7))
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', 3650))
+ARCHIVE_INTERVAL = float(os.environ.get('ARCHIVE_INTERVAL', 3600))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 200))
+
+# Health check configuration
+HEALTH_CHECK_TIMEOUT = float(os.environ.get('HEALTH_CHECK_TIMEOUT', 2))
+
 # Enums
 class UserRole(str, Enum):
     ADMIN = "admin"
@@ -44,6 +441,10 @@ class TicketStatus(str, Enum):
     RESOLVED = "resolved"
     CLOSED = "closed"
 
+class AttachmentEntity(str, Enum):
+    EQUIPMENT = "equipment"
+    TICKETS = "tickets"
+
 class EquipmentStatus(str, Enum):
     ACTIVE = "active"
     MAINTENANCE = "maintenance"
@@ -76,6 +477,10 @@ class UserResponse(BaseModel):
     role: UserRole
     created_at: datetime
 
+class Principal(BaseModel):
+    id: str
+    role: UserRole
+
 class Equipment(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -90,6 +495,8 @@ class Equipment(BaseModel):
     created_by: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    version: int = 0  # incremented on every update; the sequence number of its latest change log entry
+    deleted_at: Optional[datetime] = None  # set by soft delete; live documents store an explicit null
 
 class EquipmentCreate(BaseModel):
     name: str
@@ -124,6 +531,7 @@ class Ticket(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     resolved_at: Optional[datetime] = None
+    version: int = 0  # incremented on every update, exposed as the ETag
 
 class TicketCreate(BaseModel):
     equipment_id: str
@@ -157,6 +565,241 @@ class MaintenanceRecordCreate(BaseModel):
     cost: Optional[float] = None
     notes: Optional[str] = None
 
+class EquipmentPage(BaseModel):
+    items: List[Equipment]
+    next_cursor: Optional[str] = None
+
+class EquipmentSearchHit(Equipment):
+    score: Optional[float] = None
+
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class EquipmentSearchResult(BaseModel):
+    items: List[EquipmentSearchHit]
+    total: int
+    offset: int
+    limit: int
+    facets: Dict[str, List[FacetCount]]
+
+class ImportRowError(BaseModel):
+    row: int  # line number in the uploaded file (for CSV, the line the record starts on)
+    error: str
+
+class EquipmentImportReport(BaseModel):
+    inserted: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
+    errors_truncated: bool = False
+
+class Attachment(BaseModel):
+    id: str
+    entity_type: AttachmentEntity
+    entity_id: str
+    filename: str
+    content_type: str
+    length: int
+    sha256: Optional[str] = None
+    uploaded_by: str
+    uploaded_at: datetime
+
+class TicketPage(BaseModel):
+    items: List[Ticket]
+    next_cursor: Optional[str] = None
+
+class MaintenanceDue(BaseModel):
+    equipment_id: str
+    due_at: datetime
+    maintenance_record_id: str
+    ticket_id: Optional[str] = None  # preventive ticket generated once the date has passed
+
+class MaintenanceDuePage(BaseModel):
+    items: List[MaintenanceDue]
+    next_cursor: Optional[str] = None
+
+class SyncResponse(BaseModel):
+    equipment: List[Equipment]
+    tickets: List[Ticket]
+    deleted: Dict[str, List[str]]
+    sync_token: str
+    has_more: bool
+
+class EquipmentLookupRequest(BaseModel):
+    # Serial numbers and/or QR payloads, as scanned
+    codes: List[str] = Field(..., min_length=1, max_length=EQUIPMENT_LOOKUP_MAX_CODES)
+
+class EquipmentLookupResult(BaseModel):
+    found: Dict[str, Equipment]
+    missing: List[str]
+
+class EquipmentQRCode(BaseModel):
+    equipment_id: str
+    serial_number: str
+    payload: str
+
+class TicketBatchItem(TicketUpdate):
+    id: str
+    version: Optional[int] = None  # like If-Match on PUT: only apply if the ticket is still at this version
+
+class TicketBatchUpdate(BaseModel):
+    # Either per-ticket updates in items, or one update applied to every id in ids
+    items: List[TicketBatchItem] = Field(default_factory=list, max_length=TICKET_BATCH_MAX_ITEMS)
+    ids: List[str] = Field(default_factory=list, max_length=TICKET_BATCH_MAX_ITEMS)
+    update: Optional[TicketUpdate] = None
+
+class TicketBatchResult(BaseModel):
+    id: str
+    status: int
+    ticket: Optional[Ticket] = None
+    error: Optional[str] = None
+
+class TicketBatchResponse(BaseModel):
+    updated: int
+    failed: int
+    results: List[TicketBatchResult]
+
+class ChangeEvent(BaseModel):
+    entity_type: str
+    entity_id: str
+    seq: int
+    action: str  # created, updated, deleted
+    changes: Optional[dict] = None  # full document when created, changed fields when updated
+    actor: Optional[str] = None
+    at: datetime
+
+class ChangeEventPage(BaseModel):
+    items: List[ChangeEvent]
+    next_cursor: Optional[str] = None
+
+class EquipmentState(BaseModel):
+    at: datetime
+    seq: Optional[int] = None
+    state: Optional[dict] = None  # None if the equipment did not exist (or was deleted) at that time
+
+class MaintenanceRecordPage(BaseModel):
+    items: List[MaintenanceRecord]
+    next_cursor: Optional[str] = None
+
+# Soft-deleted equipment keeps its document (with deleted_at) until the archiver moves it
+LIVE_EQUIPMENT = {"deleted_at": None}
+
+# Indexes expected by the queries in this module, keyed by collection
+INDEX_SPECS = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "equipment": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Serials are unique among live equipment only, so a removed device's serial can be registered again
+        IndexModel(
+            [("serial_number", ASCENDING)], name="serial_number_live_unique", unique=True,
+            partialFilterExpression={"deleted_at": {"$type": "null"}}
+        ),
+        IndexModel([("serial_number", ASCENDING), ("deleted_at", ASCENDING)], name="serial_number_deleted_at"),
+        IndexModel([("name_lower", ASCENDING)], name="name_lower"),
+        IndexModel([("serial_lower", ASCENDING)], name="serial_lower"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("status", ASCENDING)], name="status"),
+        IndexModel([("location", ASCENDING), ("status", ASCENDING)], name="location_status"),
+        IndexModel([("updated_at", ASCENDING), ("id", ASCENDING)], name="updated_at_id"),
+        IndexModel(
+            [("name", TEXT), ("model", TEXT), ("manufacturer", TEXT), ("location", TEXT)],
+            name="search_text",
+            weights={"name": 10, "model": 5, "manufacturer": 3, "location": 2}
+        ),
+    ],
+    "tickets": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("created_by", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="created_by_created_at_id"),
+        IndexModel([("status", ASCENDING)], name="status"),
+        IndexModel([("equipment_id", ASCENDING), ("status", ASCENDING)], name="equipment_id_status"),
+        IndexModel([("resolved_at", ASCENDING)], name="resolved_at"),
+        IndexModel([("updated_at", ASCENDING), ("id", ASCENDING)], name="updated_at_id"),
+        IndexModel([("created_by", ASCENDING), ("updated_at", ASCENDING), ("id", ASCENDING)], name="created_by_updated_at_id"),
+    ],
+    "tombstones": [
+        IndexModel([("deleted_at", ASCENDING)], name="deleted_at_ttl", expireAfterSeconds=TOMBSTONE_RETENTION_DAYS * 86400),
+    ],
+    "attachments.files": [
+        IndexModel([("metadata.entity_type", ASCENDING), ("metadata.entity_id", ASCENDING), ("uploadDate", ASCENDING)], name="entity_upload_date"),
+    ],
+    "maintenance_records": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("equipment_id", ASCENDING), ("performed_at", ASCENDING), ("id", ASCENDING)], name="equipment_id_performed_at_id"),
+        IndexModel([("performed_at", ASCENDING)], name="performed_at"),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    # Archive tier: documents keep their _id and expire ARCHIVE_RETENTION_DAYS after archiving
+    # (ensure_indexes applies a changed retention to these TTL indexes)
+    "equipment_archive": [
+        IndexModel([("id", ASCENDING)], name="id"),
+        IndexModel([("serial_number", ASCENDING)], name="serial_number"),
+        IndexModel([("archived_at", ASCENDING)], name="archived_at_ttl", expireAfterSeconds=ARCHIVE_RETENTION_DAYS * 86400),
+    ],
+    "tickets_archive": [
+        IndexModel([("equipment_id", ASCENDING)], name="equipment_id"),
+        IndexModel([("archived_at", ASCENDING)], name="archived_at_ttl", expireAfterSeconds=ARCHIVE_RETENTION_DAYS * 86400),
+    ],
+    "maintenance_records_archive": [
+        IndexModel([("equipment_id", ASCENDING)], name="equipment_id"),
+        IndexModel([("archived_at", ASCENDING)], name="archived_at_ttl", expireAfterSeconds=ARCHIVE_RETENTION_DAYS * 86400),
+    ],
+    "change_log": [
+        IndexModel([("entity_id", ASCENDING), ("seq", ASCENDING)], name="entity_id_seq_unique", unique=True),
+    ],
+    "change_snapshots": [
+        IndexModel([("entity_id", ASCENDING), ("seq", ASCENDING)], name="entity_id_seq_unique", unique=True),
+    ],
+    # One entry per equipment (id = equipment id), ordered by due date
+    "maintenance_schedule": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("due_at", ASCENDING), ("id", ASCENDING)], name="due_at_id"),
+        IndexModel([("ticket_id", ASCENDING), ("due_at", ASCENDING), ("id", ASCENDING)], name="ticket_id_due_at_id"),
+    ],
+}
+
+# Indexes replaced by an entry above; dropped once their replacement exists
+OBSOLETE_INDEXES = {
+    "equipment": ["serial_number_unique"],
+}
+
+def equipment_search_keys(document: dict) -> dict:
+    # Lowercased copies behind the prefix search: a case-sensitive anchored regex on them can use an index
+    keys = {}
+    if document.get("name") is not None:
+        keys["name_lower"] = document["name"].lower()
+    if document.get("serial_number") is not None:
+        keys["serial_lower"] = document["serial_number"].lower()
+    return keys
+
+async def backfill_deleted_at(collection):
+    # The partial unique index only sees an explicit null; older documents have no deleted_at at all
+    await collection.update_many({"deleted_at": {"$exists": False}}, {"$set": {"deleted_at": None}})
+
+async def backfill_search_keys(collection):
+    # Lowercased in Python rather than with $toLower, which is only defined for ASCII
+    query = {"$or": [{"name_lower": {"$exists": False}}, {"serial_lower": {"$exists": False}}]}
+    while True:
+        documents = await collection.find(query, {"_id": 1, "name": 1, "serial_number": 1}).limit(1000).to_list(1000)
+        if not documents:
+            return
+        await collection.bulk_write(
+            [UpdateOne({"_id": document["_id"]}, {"$set": equipment_search_keys(document)}) for document in documents],
+            ordered=False
+        )
+
+# Run right before an index is first built, for documents written before it was declared
+INDEX_BACKFILLS = {
+    ("equipment", "serial_number_live_unique"): backfill_deleted_at,
+    ("equipment", "name_lower"): backfill_search_keys,
+}
+
 # Helper functions
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -164,6 +807,172 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hash: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hash.encode('utf-8'))
 
+class PasswordHasher:
+    """Runs bcrypt on a bounded worker pool so it never blocks the event loop."""
+
+    def __init__(self, workers: int, max_pending: int, use_processes: bool = False):
+        if use_processes:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.max_pending = max_pending
+        self.pending = 0
+        self.dummy_hash = None
+
+    async def _run(self, func, *args):
+        # Shed load instead of letting the queue (and login latency) grow unbounded
+        if self.pending >= self.max_pending:
+            BCRYPT_REJECTED.inc()
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication service busy, try again shortly",
+                headers={"Retry-After": "1"}
+            )
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+            BCRYPT_SECONDS.labels(func.__name__).observe(time.perf_counter() - started)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, hash: str) -> bool:
+        return await self._run(verify_password, password, hash)
+
+    async def verify_unknown_user(self, password: str) -> bool:
+        # Same bcrypt work as a real check, so response time does not reveal whether a username exists
+        if self.dummy_hash is None:
+            self.dummy_hash = await self.hash(uuid.uuid4().hex)
+        await self.verify(password, self.dummy_hash)
+        return False
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher(BCRYPT_WORKERS, BCRYPT_MAX_PENDING, use_processes=BCRYPT_POOL == 'process')
+
+class MemoryRateLimitStore:
+    """Per-process sliding-window counters, split over shards that each evict their least recently used keys."""
+
+    def __init__(self, shards: int, max_keys: int):
+        self.shards = [OrderedDict() for _ in range(shards)]
+        self.max_keys_per_shard = max(1, max_keys // shards)
+
+    def shard(self, key: str) -> OrderedDict:
+        return self.shards[hash(key) % len(self.shards)]
+
+    def counts(self, shard: OrderedDict, key: str, window: int):
+        # Stored as [window, current, previous]; rolls forward when the window has moved on
+        entry = shard.get(key)
+        if entry is None or entry[0] < window - 1:
+            return [window, 0, 0]
+        if entry[0] == window - 1:
+            return [window, 0, entry[1]]
+        return entry
+
+    async def get(self, key: str, window: int):
+        _, current, previous = self.counts(self.shard(key), key, window)
+        return current, previous
+
+    async def add(self, key: str, window: int, ttl: float):
+        shard = self.shard(key)
+        entry = self.counts(shard, key, window)
+        entry[1] += 1
+        shard[key] = entry
+        shard.move_to_end(key)
+        while len(shard) > self.max_keys_per_shard:
+            shard.popitem(last=False)
+        return entry[1], entry[2]
+
+    async def clear(self, key: str, window: int):
+        self.shard(key).pop(key, None)
+
+class MongoRateLimitStore:
+    """Sliding-window counters shared by all workers: one document per key and window, expired by a TTL index."""
+
+    async def get(self, key: str, window: int):
+        documents = await db.rate_limits.find({"_id": {"$in": [f"{key}:{window}", f"{key}:{window - 1}"]}}).to_list(2)
+        counts = {document["_id"]: document["count"] for document in documents}
+        return counts.get(f"{key}:{window}", 0), counts.get(f"{key}:{window - 1}", 0)
+
+    async def add(self, key: str, window: int, ttl: float):
+        current, previous = await asyncio.gather(
+            db.rate_limits.find_one_and_update(
+                {"_id": f"{key}:{window}"},
+                {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            ),
+            db.rate_limits.find_one({"_id": f"{key}:{window - 1}"})
+        )
+        return current["count"], previous["count"] if previous else 0
+
+    async def clear(self, key: str, window: int):
+        await db.rate_limits.delete_many({"_id": {"$in": [f"{key}:{window}", f"{key}:{window - 1}"]}})
+
+class SlidingWindowLimiter:
+    """Sliding-window counter: this window's count plus the previous one's, weighted by how much of it still overlaps."""
+
+    def __init__(self, name: str, limit: int, window: float, store):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.store = store
+
+    def position(self):
+        now = time.time()
+        return int(now // self.window), (now % self.window) / self.window
+
+    def retry_after(self, current: int, previous: int, elapsed: float) -> int:
+        # Seconds until the estimate falls back under the limit, assuming no further hits
+        if current < self.limit and previous:
+            needed = 1 - (self.limit - current) / previous
+            return max(1, math.ceil((needed - elapsed) * self.window))
+        needed = 1 - self.limit / current if current else 0
+        return max(1, math.ceil((1 - elapsed + needed) * self.window))
+
+    async def check(self, key: str, hit: bool = True):
+        """Counts a hit (unless hit=False) and raises 429 once the estimate exceeds the limit."""
+        window, elapsed = self.position()
+        if hit:
+            current, previous = await self.store.add(f"{self.name}:{key}", window, self.window * 2)
+            over = previous * (1 - elapsed) + current > self.limit
+        else:
+            current, previous = await self.store.get(f"{self.name}:{key}", window)
+            over = previous * (1 - elapsed) + current >= self.limit
+        if over:
+            LOGIN_RATE_LIMITED.labels(self.name).inc()
+            raise HTTPException(
+                status_code=429,
+                detail="Too many login attempts, try again later",
+                headers={"Retry-After": str(self.retry_after(current, previous, elapsed))}
+            )
+
+    async def hit(self, key: str):
+        window, _ = self.position()
+        await self.store.add(f"{self.name}:{key}", window, self.window * 2)
+
+    async def reset(self, key: str):
+        window, _ = self.position()
+        await self.store.clear(f"{self.name}:{key}", window)
+
+rate_limit_store = MongoRateLimitStore() if LOGIN_RATE_LIMIT_BACKEND == 'mongo' else MemoryRateLimitStore(RATE_LIMIT_SHARDS, RATE_LIMIT_MAX_KEYS)
+# Every attempt counts against the client address; only failures count against a username
+login_ip_limiter = SlidingWindowLimiter("login_ip", LOGIN_IP_LIMIT, LOGIN_IP_WINDOW, rate_limit_store)
+login_username_limiter = SlidingWindowLimiter("login_username", LOGIN_USERNAME_FAILURES, LOGIN_USERNAME_WINDOW, rate_limit_store)
+
+def client_ip(request: Request) -> str:
+    peer = request.client.host if request.client else "unknown"
+    if peer in TRUSTED_PROXIES:
+        forwarded = request.headers.get("x-real-ip") or request.headers.get("x-forwarded-for", "").split(",")[0].strip()
+        if forwarded:
+            return forwarded
+    return peer
+
 def create_jwt_token(user_id: str, role: str) -> str:
     payload = {
         "user_id": user_id,
@@ -172,28 +981,1388 @@ def create_jwt_token(user_id: str, role: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+class TTLCache:
+    """In-process LRU cache with a per-entry TTL; lookups are counted on an optional hit/miss metric."""
+
+    def __init__(self, max_size: int, ttl: float, lookups_metric=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lookups_metric = lookups_metric
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, outcome: str):
+        if outcome == "hit":
+            self.hits += 1
+        else:
+            self.misses += 1
+        if self.lookups_metric is not None:
+            self.lookups_metric.labels(outcome).inc()
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.remove(key)
+            self.count("miss")
+            return None
+        self.entries.move_to_end(key)
+        self.count("hit")
+        return entry[1]
+
+    def set(self, key: str, value):
+        self.remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        while len(self.entries) > self.max_size:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key: str):
+        """Drops one entry and returns its value; every removal (eviction, expiry, invalidation) goes through here."""
+        entry = self.entries.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def invalidate(self, key: str):
+        self.remove(key)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+# UserResponse objects by user id
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_LOOKUPS)
+
+def decode_token(credentials: HTTPAuthorizationCredentials) -> dict:
     try:
         payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("user_id")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user = await db.users.find_one({"id": user_id})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        return UserResponse(**user)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    
+    if payload.get("user_id") is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+async def load_user(user_id: str) -> UserResponse:
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    
+    user = await db.users.find_one({"id": user_id})
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    user_response = UserResponse(**user)
+    user_cache.set(user_response.id, user_response)
+    return user_response
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = decode_token(credentials)
+    return await load_user(payload["user_id"])
+
+async def get_read_principal(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # Read-only routes only need id and role; optionally take the role straight from the signed token
+    payload = decode_token(credentials)
+    if TRUST_TOKEN_ROLE and payload.get("role") in {role.value for role in UserRole}:
+        return Principal(id=payload["user_id"], role=payload["role"])
+    return await load_user(payload["user_id"])
 
 async def get_admin_user(current_user: UserResponse = Depends(get_current_user)):
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
+def encode_cursor(document: dict, sort_field: str) -> str:
+    position = {"t": document[sort_field].isoformat(), "id": document["id"]}
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(position["t"]), str(position["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def fetch_page(collection, query: dict, sort_field: str, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None):
+    """Keyset pagination ordered by (sort_field, id); returns (documents, next_cursor)."""
+    if cursor:
+        after_value, after_id = decode_cursor(cursor)
+        keyset = {"$or": [
+            {sort_field: {"$gt": after_value}},
+            {sort_field: after_value, "id": {"$gt": after_id}}
+        ]}
+        query = {"$and": [query, keyset]} if query else keyset
+    
+    documents = await collection.find(query, projection).sort([(sort_field, 1), ("id", 1)]).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1], sort_field)
+    return documents, next_cursor
+
+def encode_sync_token(state: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, default=export_value).encode('utf-8')).decode('ascii')
+
+def decode_sync_token(token: str) -> dict:
+    # {"since": iso} between syncs; a batched sync in progress also carries "until" and per-source cursors
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return {
+            "since": datetime.fromisoformat(state["since"]) if state.get("since") else None,
+            "until": datetime.fromisoformat(state["until"]) if state.get("until") else None,
+            "pending": dict(state.get("pending", {}))
+        }
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+async def record_tombstone(collection: str, entity_id: str, owner: Optional[str] = None):
+    # Hard deletes leave a tombstone so delta sync can tell clients to drop the record;
+    # tombstones expire after TOMBSTONE_RETENTION_DAYS via a TTL index
+    await record_tombstones(collection, [(entity_id, owner)])
+
+async def record_tombstones(collection: str, entries: List[tuple]):
+    """Writes one tombstone per (entity_id, owner) pair with a single insert_many."""
+    if not entries:
+        return
+    deleted_at = datetime.utcnow()
+    await db.tombstones.insert_many([
+        {"collection": collection, "id": entity_id, "owner": owner, "deleted_at": deleted_at}
+        for entity_id, owner in entries
+    ])
+
+def model_projection(model) -> dict:
+    projection = {field: 1 for field in model.model_fields}
+    projection["_id"] = 0
+    return projection
+
+def model_defaults(model) -> dict:
+    # Plain (non-factory) defaults, used to fill fields missing from older documents
+    return {
+        name: field.default
+        for name, field in model.model_fields.items()
+        if not field.is_required() and field.default_factory is None
+    }
+
+def fast_items(documents: List[dict], defaults: dict) -> List[dict]:
+    """Documents already projected to a model's fields, completed with its defaults.
+
+    Used by read-heavy routes instead of building a model per document and letting
+    response_model validate everything a second time; the data was validated on write.
+    """
+    for document in documents:
+        for name, default in defaults.items():
+            if name not in document:
+                document[name] = default
+    return documents
+
+# expand= names: (related collection, referencing field)
+EXPANSIONS = {
+    "equipment": ("equipment", "equipment_id"),
+    "created_by": ("users", "created_by"),
+    "assigned_to": ("users", "assigned_to"),
+    "performed_by": ("users", "performed_by"),
+}
+# Fields embedded for each related collection; users never expose email or password hash
+EXPANSION_PROJECTIONS = {
+    "equipment": {"_id": 0, "id": 1, "name": 1, "model": 1, "manufacturer": 1, "serial_number": 1, "location": 1, "status": 1},
+    "users": {"_id": 0, "id": 1, "username": 1, "role": 1},
+}
+
+def parse_expand(expand: Optional[str], allowed: set) -> List[str]:
+    names = [name.strip() for name in expand.split(",") if name.strip()] if expand else []
+    unknown = set(names) - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot expand {', '.join(sorted(unknown))}; allowed: {', '.join(sorted(allowed))}")
+    return list(dict.fromkeys(names))
+
+class RelatedLoader:
+    """Per-request cache of related documents, fetched with one $in query per collection.
+
+    Ids shared between items and between fields (created_by and assigned_to both point at
+    users) are loaded once.
+    """
+
+    def __init__(self):
+        self.loaded = {collection: {} for collection in EXPANSION_PROJECTIONS}
+
+    async def load(self, collection: str, ids: set):
+        cache = self.loaded[collection]
+        missing = [related_id for related_id in ids if related_id and related_id not in cache]
+        if not missing:
+            return
+        documents = await db[collection].find({"id": {"$in": missing}}, EXPANSION_PROJECTIONS[collection]).to_list(None)
+        for document in documents:
+            cache[document["id"]] = document
+        for related_id in missing:
+            cache.setdefault(related_id, None)
+
+    async def expand(self, items: List[dict], names: List[str]):
+        # Embeds each item's related documents under "expanded"; missing references become None
+        wanted = {}
+        for name in names:
+            collection, field = EXPANSIONS[name]
+            wanted.setdefault(collection, set()).update(item.get(field) for item in items)
+        await asyncio.gather(*[self.load(collection, ids) for collection, ids in wanted.items()])
+        for item in items:
+            item["expanded"] = {
+                name: self.loaded[EXPANSIONS[name][0]].get(item.get(EXPANSIONS[name][1]))
+                for name in names
+            }
+
+async def list_or_page(model, collection, query: dict, sort_field: str, limit: Optional[int], cursor: Optional[str], expand: Optional[List[str]] = None):
+    # Without paging parameters keep the legacy list shape, but signal truncation via X-Next-Cursor
+    paged = limit is not None or cursor is not None
+    documents, next_cursor = await fetch_page(
+        collection, query, sort_field, limit or (MAX_PAGE_SIZE if paged else LEGACY_LIST_LIMIT), cursor,
+        projection=model_projection(model)
+    )
+    items = fast_items(documents, model_defaults(model))
+    if expand:
+        await RelatedLoader().expand(items, expand)
+    if paged:
+        return ORJSONResponse({"items": items, "next_cursor": next_cursor})
+    return ORJSONResponse(items, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+def response_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison, so a W/ prefix added by a proxy still matches
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+class ResponseCache:
+    """In-process LRU cache of rendered JSON bodies, bounded by total size and invalidated by tag.
+
+    Each entry is tagged with what it was built from (e.g. "equipment", "equipment:<id>");
+    write handlers invalidate those tags. A per-tag generation counter keeps a response that
+    was being built while a write landed from being stored after the invalidation.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tag_keys = {}
+        self.generations = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None or entry["expires"] < time.monotonic():
+            if entry is not None:
+                self.remove(key)
+            self.misses += 1
+            RESPONSE_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        RESPONSE_CACHE_LOOKUPS.labels("hit").inc()
+        return entry
+
+    def generation(self, tags: List[str]) -> tuple:
+        return tuple(self.generations.get(tag, 0) for tag in tags)
+
+    def put(self, key: str, body: bytes, headers: dict, tags: List[str], generation: tuple) -> dict:
+        entry = {"body": body, "headers": headers, "etag": response_etag(body), "tags": tags, "expires": time.monotonic() + self.ttl}
+        # Returned to the caller either way; only stored if nothing it depends on changed meanwhile
+        if generation != self.generation(tags) or len(body) > self.max_bytes:
+            return entry
+        self.remove(key)
+        self.entries[key] = entry
+        self.size += len(body)
+        for tag in tags:
+            self.tag_keys.setdefault(tag, set()).add(key)
+        while self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+        return entry
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry["body"])
+        for tag in entry["tags"]:
+            keys = self.tag_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_keys[tag]
+
+    def invalidate(self, *tags: str):
+        for tag in tags:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+            for key in list(self.tag_keys.get(tag, ())):
+                self.remove(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL)
+
+async def cached_response(request: Request, scope: str, tags: List[str], build) -> Response:
+    """Serves a GET from the response cache, or builds, stores and serves it; honours If-None-Match.
+
+    scope names who may share the entry (e.g. "all" for data every reader can see); the path
+    and sorted query string complete the key. Only 200 responses are stored.
+    """
+    key = f"{scope}|{request.url.path}|{sorted(request.query_params.multi_items())}"
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation(tags)
+        response = await build()
+        if response.status_code != 200:
+            return response
+        headers = {name: response.headers[name] for name in RESPONSE_CACHE_HEADERS if name in response.headers}
+        entry = response_cache.put(key, response.body, headers, tags, generation)
+    
+    headers = {**entry["headers"], "ETag": entry["etag"], "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+class EquipmentLookupCache(TTLCache):
+    """Small LRU of recently scanned equipment, keyed by "serial_number:<serial>" or "id:<equipment id>"."""
+
+    def __init__(self, max_size: int, ttl: float):
+        super().__init__(max_size, ttl)
+        self.codes_by_id = {}
+
+    def set(self, code: str, equipment: dict):
+        super().set(code, equipment)
+        self.codes_by_id.setdefault(equipment["id"], set()).add(code)
+
+    def remove(self, code: str):
+        equipment = super().remove(code)
+        if equipment is not None:
+            codes = self.codes_by_id.get(equipment["id"])
+            if codes is not None:
+                codes.discard(code)
+                if not codes:
+                    del self.codes_by_id[equipment["id"]]
+        return equipment
+
+    def invalidate(self, equipment_id: str):
+        # Covers the old serial number too when an update changes it
+        for code in list(self.codes_by_id.get(equipment_id, ())):
+            self.remove(code)
+
+    def clear(self):
+        super().clear()
+        self.codes_by_id.clear()
+
+equipment_lookup_cache = EquipmentLookupCache(EQUIPMENT_LOOKUP_CACHE_SIZE, EQUIPMENT_LOOKUP_CACHE_TTL)
+
+def invalidate_equipment(equipment_id: Optional[str] = None):
+    # Lists and searches depend on every document; the single-document entry only on its own
+    response_cache.invalidate("equipment", *([f"equipment:{equipment_id}"] if equipment_id else []))
+    if equipment_id:
+        equipment_lookup_cache.invalidate(equipment_id)
+
+def qr_signature(equipment_id: str) -> str:
+    return hmac.new(JWT_SECRET.encode('utf-8'), equipment_id.encode('utf-8'), hashlib.sha256).hexdigest()[:12]
+
+def qr_payload(equipment_id: str) -> str:
+    # Signed so a label cannot be forged or mistyped into pointing at another device
+    return f"{QR_PAYLOAD_PREFIX}:{equipment_id}:{qr_signature(equipment_id)}"
+
+def parse_lookup_code(code: str):
+    """Returns ("id", equipment id) for a valid QR payload, ("serial_number", serial) otherwise, None if unusable."""
+    code = code.strip()
+    if code.startswith(f"{QR_PAYLOAD_PREFIX}:"):
+        _, _, rest = code.partition(":")
+        equipment_id, _, signature = rest.rpartition(":")
+        if equipment_id and hmac.compare_digest(signature, qr_signature(equipment_id)):
+            return "id", equipment_id
+        return None
+    return ("serial_number", code) if code else None
+
+async def lookup_equipment(codes: List[str]) -> dict:
+    """Resolves scanned codes, serial numbers or QR payloads, to equipment keyed by code."""
+    parsed = {code: parse_lookup_code(code) for code in dict.fromkeys(codes)}
+    return await resolve_equipment({code: key for code, key in parsed.items() if key is not None})
+
+async def resolve_equipment(keys: Dict[str, tuple]) -> dict:
+    """Maps each code's (field, value) to live equipment: cache first, then one indexed query for the rest."""
+    found = {}
+    wanted = {}
+    for code, parsed in keys.items():
+        cached = equipment_lookup_cache.get(f"{parsed[0]}:{parsed[1]}")
+        if cached is not None:
+            found[code] = cached
+        else:
+            wanted.setdefault(parsed, []).append(code)
+    
+    if wanted:
+        serials = [value for field, value in wanted if field == "serial_number"]
+        ids = [value for field, value in wanted if field == "id"]
+        clauses = ([{"serial_number": {"$in": serials}}] if serials else []) + ([{"id": {"$in": ids}}] if ids else [])
+        documents = await db.equipment.find(
+            {"$or": clauses, **LIVE_EQUIPMENT} if len(clauses) > 1 else {**clauses[0], **LIVE_EQUIPMENT},
+            model_projection(Equipment)
+        ).to_list(None)
+        for document in fast_items(documents, model_defaults(Equipment)):
+            for field in ("serial_number", "id"):
+                for code in wanted.get((field, document[field]), []):
+                    found[code] = document
+                    equipment_lookup_cache.set(f"{field}:{document[field]}", document)
+    return found
+
+def find_index(model: IndexModel, existing: dict):
+    # An equivalent index created under another name (e.g. the default "id_1") also counts
+    spec = model.document
+    for name, info in existing.items():
+        if name == spec["name"] or (
+            list(info["key"]) == list(spec["key"].items())
+            and info.get("unique", False) == spec.get("unique", False)
+            and info.get("partialFilterExpression") == spec.get("partialFilterExpression")
+        ):
+            return name, info
+    return None
+
+def index_present(model: IndexModel, existing: dict) -> bool:
+    return find_index(model, existing) is not None
+
+async def reconcile_ttl(collection_name: str, model: IndexModel, name: str, info: dict):
+    # A changed *_RETENTION_DAYS only reaches an existing TTL index through collMod
+    expire_after = model.document.get("expireAfterSeconds")
+    if expire_after is None or info.get("expireAfterSeconds") == expire_after:
+        return
+    try:
+        await db.command("collMod", collection_name, index={"name": name, "expireAfterSeconds": expire_after})
+        logger.info(f"Changed {collection_name}.{name} expireAfterSeconds from {info.get('expireAfterSeconds')} to {expire_after}")
+    except OperationFailure as e:
+        logger.error(f"Could not change the TTL of {collection_name}.{name}: {e}")
+
+async def ensure_indexes() -> List[str]:
+    """Create any missing indexes from INDEX_SPECS; returns the expected indexes that still do not exist."""
+    missing = []
+    for collection_name, models in INDEX_SPECS.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        for model in models:
+            found = find_index(model, existing)
+            if found:
+                await reconcile_ttl(collection_name, model, *found)
+                continue
+            name = model.document["name"]
+            try:
+                backfill = INDEX_BACKFILLS.get((collection_name, name))
+                if backfill:
+                    await backfill(collection)
+                await collection.create_indexes([model])
+                logger.info(f"Created index {collection_name}.{name}")
+            except OperationFailure as e:
+                logger.error(f"Could not create index {collection_name}.{name}: {e}")
+        
+        existing = await collection.index_information()
+        absent = [f"{collection_name}.{model.document['name']}" for model in models if not index_present(model, existing)]
+        missing.extend(absent)
+        # Keep an old index until everything replacing it has been built
+        if absent:
+            continue
+        for name in OBSOLETE_INDEXES.get(collection_name, []):
+            if name in existing:
+                await collection.drop_index(name)
+                logger.info(f"Dropped obsolete index {collection_name}.{name}")
+    
+    if missing:
+        logger.warning(f"Expected indexes not found: {', '.join(missing)}")
+    return missing
+
+def ticket_etag(ticket: dict) -> str:
+    return f'"{ticket.get("version", 0)}"'
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    # Returns the expected ticket version, or None when no precondition applies
+    if if_match is None or if_match.strip() == "*":
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=412, detail="Ticket was modified by someone else")
+
+class DashboardCounters:
+    """In-memory dashboard counters, adjusted on every write and periodically recounted to fix drift."""
+
+    def __init__(self):
+        self.counts = {
+            "total_equipment": 0,
+            "active_equipment": 0,
+            "open_tickets": 0,
+            "total_users": 0
+        }
+        self.recounted_at = None
+        self.recounted_monotonic = None
+
+    async def recount(self):
+        total_equipment, active_equipment, open_tickets, total_users = await asyncio.gather(
+            db.equipment.count_documents(LIVE_EQUIPMENT),
+            db.equipment.count_documents({"status": EquipmentStatus.ACTIVE}),
+            db.tickets.count_documents({"status": TicketStatus.OPEN}),
+            db.users.count_documents({})
+        )
+        self.counts = {
+            "total_equipment": total_equipment,
+            "active_equipment": active_equipment,
+            "open_tickets": open_tickets,
+            "total_users": total_users
+        }
+        self.recounted_at = datetime.utcnow()
+        self.recounted_monotonic = time.monotonic()
+
+    def adjust(self, counter: str, delta: int):
+        if delta:
+            self.counts[counter] = max(0, self.counts[counter] + delta)
+
+    def equipment_changed(self, before: Optional[dict], after: Optional[dict]):
+        self.adjust("total_equipment", (after is not None) - (before is not None))
+        was_active = before is not None and before.get("status") == EquipmentStatus.ACTIVE
+        is_active = after is not None and after.get("status") == EquipmentStatus.ACTIVE
+        self.adjust("active_equipment", is_active - was_active)
+
+    def ticket_changed(self, before: Optional[dict], after: Optional[dict]):
+        was_open = before is not None and before.get("status") == TicketStatus.OPEN
+        is_open = after is not None and after.get("status") == TicketStatus.OPEN
+        self.adjust("open_tickets", is_open - was_open)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.counts,
+            "last_recount_at": self.recounted_at,
+            "snapshot_age_seconds": round(time.monotonic() - self.recounted_monotonic, 3)
+        }
+
+dashboard_counters = DashboardCounters()
+
+async def run_periodically(interval: float, job, name: str):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"Background job {name} failed")
+
+background_tasks = []
+
+IMPORT_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+async def iter_request_lines(request: Request):
+    # Decode the body incrementally so the upload is never held in memory as a whole
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+async def iter_import_rows(lines, import_format: str):
+    """Yields (line_number, row) pairs; row is a dict, or an error message for unparseable rows."""
+    # Every line counts, blank ones and the CSV header included, so errors match the uploaded file
+    if import_format == "ndjson":
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, f"Invalid JSON: {e}"
+                continue
+            yield line_number, row if isinstance(row, dict) else "Expected a JSON object"
+        return
+    
+    # CSV: a record ends at a newline outside quotes, i.e. once the quote count is even
+    header = None
+    line_number = 0
+    record_start = 1
+    record = ""
+    async for line in lines:
+        line_number += 1
+        if not record:
+            record_start = line_number
+        record += line
+        if record.count('"') % 2:
+            continue
+        values, record = next(csv.reader([record])), ""
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+        if len(values) != len(header):
+            yield record_start, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        # Empty cells mean "not provided" so optional fields fall back to their defaults
+        yield record_start, {key: value for key, value in zip(header, values) if value != ""}
+    if record.strip():
+        yield record_start, "Unterminated quoted field"
+
+def format_validation_error(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors())
+
+class EquipmentImporter:
+    """Validates import rows in chunks and writes each chunk with one unordered insert_many."""
+
+    def __init__(self, created_by: str):
+        self.created_by = created_by
+        self.report = EquipmentImportReport()
+        self.chunk = []
+
+    def fail(self, row_number: int, error: str):
+        self.report.failed += 1
+        if len(self.report.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.report.errors.append(ImportRowError(row=row_number, error=error))
+        else:
+            self.report.errors_truncated = True
+
+    async def add(self, row_number: int, row):
+        if isinstance(row, str):
+            self.fail(row_number, row)
+        else:
+            try:
+                equipment_dict = EquipmentCreate(**row).dict()
+                equipment_dict['created_by'] = self.created_by
+                self.chunk.append((row_number, Equipment(**equipment_dict).dict()))
+            except ValidationError as e:
+                self.fail(row_number, format_validation_error(e))
+        if len(self.chunk) >= IMPORT_CHUNK_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        if not self.chunk:
+            return
+        chunk, self.chunk = self.chunk, []
+        documents = [document for _, document in chunk]
+        failed_indexes = set()
+        try:
+            await db.equipment.insert_many(
+                [{**document, **equipment_search_keys(document)} for document in documents], ordered=False
+            )
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                index = write_error["index"]
+                failed_indexes.add(index)
+                if write_error.get("code") == 11000:
+                    self.fail(chunk[index][0], "Serial number already exists")
+                else:
+                    self.fail(chunk[index][0], write_error.get("errmsg", "Write failed"))
+        
+        for index, document in enumerate(documents):
+            if index not in failed_indexes:
+                self.report.inserted += 1
+                dashboard_counters.equipment_changed(None, document)
+                change_log.record("equipment", document["id"], 0, "created", document, self.created_by)
+        if len(failed_indexes) < len(documents):
+            invalidate_equipment()
+    
+    async def finish(self):
+        await self.flush()
+        # One event for the whole import, so subscribers refetch once rather than after every chunk
+        if self.report.inserted:
+            publish_change("equipment", "imported", None, {"inserted": self.report.inserted})
+
+def export_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return str(value)
+
+def attachment_from_file(file_doc: dict) -> Attachment:
+    metadata = file_doc.get("metadata") or {}
+    return Attachment(
+        id=str(file_doc["_id"]),
+        entity_type=metadata["entity_type"],
+        entity_id=metadata["entity_id"],
+        filename=file_doc["filename"],
+        content_type=metadata.get("content_type", "application/octet-stream"),
+        length=file_doc["length"],
+        sha256=file_doc.get("sha256"),
+        uploaded_by=metadata["uploaded_by"],
+        uploaded_at=file_doc["uploadDate"]
+    )
+
+def content_disposition(filename: str) -> str:
+    # Headers are latin-1 only: an ASCII fallback for old clients plus the RFC 5987 UTF-8 form
+    fallback = "".join(
+        ch if 32 <= ord(ch) < 127 and ch not in '"\\' else "_" for ch in filename
+    )
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+async def check_attachment_entity(entity_type: AttachmentEntity, entity_id: str, current_user):
+    if entity_type == AttachmentEntity.EQUIPMENT:
+        if not await db.equipment.find_one({"id": entity_id, **LIVE_EQUIPMENT}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Equipment not found")
+        return
+    
+    ticket = await db.tickets.find_one({"id": entity_id}, {"created_by": 1})
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    if current_user.role != UserRole.ADMIN and ticket['created_by'] != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+def parse_range(range_header: Optional[str], length: int):
+    """Parses a single byte range into inclusive (start, end); None means send the whole file."""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text == "":
+            start, end = max(0, length - int(end_text)), length - 1
+        else:
+            start = int(start_text)
+            end = min(int(end_text), length - 1) if end_text else length - 1
+    except ValueError:
+        return None
+    if start > end or start >= length:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{length}"})
+    return start, end
+
+class Subscription:
+    def __init__(self, user_id: str, is_admin: bool, topics: set, queue_size: int):
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self.topics = topics
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+class EventHub:
+    """In-process fan-out of change events to WebSocket subscribers with bounded per-client queues."""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscriptions = set()
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def subscribe(self, user, topics: set) -> Subscription:
+        subscription = Subscription(user.id, user.role == UserRole.ADMIN, topics, self.queue_size)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+    def publish(self, topic: str, event: dict, owner: Optional[str] = None):
+        # Serialize once for all subscribers; owner restricts delivery to that user and admins
+        message = json.dumps({"topic": topic, **event}, default=export_value)
+        self.published += 1
+        for subscription in list(self.subscriptions):
+            if topic not in subscription.topics:
+                continue
+            if owner is not None and not subscription.is_admin and subscription.user_id != owner:
+                continue
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.drop(subscription)
+
+    def drop(self, subscription: Subscription):
+        # A consumer that cannot keep up is disconnected rather than allowed to hold memory;
+        # the None sentinel tells its sender loop to close the socket
+        self.unsubscribe(subscription)
+        self.dropped_subscribers += 1
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscriptions),
+            "published": self.published,
+            "dropped_subscribers": self.dropped_subscribers
+        }
+
+event_hub = EventHub(EVENT_QUEUE_SIZE)
+
+def publish_change(topic: str, action: str, entity_id: str, data: Optional[dict] = None, owner: Optional[str] = None):
+    # With EVENT_SOURCE=change_stream the watcher publishes instead, so writes are not announced twice
+    if EVENT_SOURCE != 'local':
+        return
+    event_hub.publish(topic, {"action": action, "id": entity_id, "data": data}, owner=owner)
+
+# Buffered, append-only per-entity history (seq = version) with a full snapshot every CHANGE_LOG_SNAPSHOT_EVERY versions
+class ChangeLog:
+    def __init__(self, batch_size: int, snapshot_every: int, max_pending: int):
+        self.batch_size = batch_size
+        self.snapshot_every = snapshot_every
+        self.max_pending = max_pending
+        self.events = []
+        self.snapshots = []
+        self.baselines = {}  # entity_id -> pre-image snapshot, written only if the entity has no earlier entry
+        self.flush_task = None
+        self.dropped = 0
+
+    def record(self, entity_type: str, entity_id: str, seq: int, action: str, changes: Optional[dict] = None,
+               actor: Optional[str] = None, state: Optional[dict] = None, previous: Optional[dict] = None):
+        at = datetime.utcnow()
+        if previous is not None and seq > 0:
+            baseline = self.baselines.get(entity_id)
+            if baseline is None or baseline["seq"] > seq - 1:
+                self.baselines[entity_id] = {
+                    "entity_type": entity_type,
+                    "entity_id": entity_id,
+                    "seq": seq - 1,
+                    "state": {k: v for k, v in previous.items() if k != "_id"},
+                    "at": previous.get("updated_at") or previous.get("created_at") or datetime(1970, 1, 1)
+                }
+        if changes is not None:
+            changes = {k: v for k, v in changes.items() if k not in ("_id", "updated_at", "version")}
+        self.events.append({
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "seq": seq,
+            "action": action,
+            "changes": changes,
+            "actor": actor,
+            "at": at
+        })
+        if state is not None and seq > 0 and seq % self.snapshot_every == 0:
+            self.snapshots.append({
+                "entity_type": entity_type,
+                "entity_id": entity_id,
+                "seq": seq,
+                "state": {k: v for k, v in state.items() if k != "_id"},
+                "at": at
+            })
+        if len(self.events) >= self.batch_size and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = asyncio.create_task(self.flush())
+
+    async def write(self, collection: str, documents: List[dict]) -> List[dict]:
+        # Returns the documents that still need writing; duplicates (already written) are dropped
+        if not documents:
+            return []
+        try:
+            await db[collection].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                if write_error.get("code") != 11000:
+                    logger.error(f"Dropped {collection} entry: {write_error.get('errmsg')}")
+        except Exception:
+            logger.exception(f"Could not write {collection}, will retry")
+            return documents
+        return []
+
+    async def pending_baselines(self, events: List[dict]) -> List[dict]:
+        # Keeps the baselines of entities with no entry before them, neither logged nor in this batch
+        baselines, self.baselines = self.baselines, {}
+        if not baselines:
+            return []
+        earliest = {}
+        for event in events:
+            earliest[event["entity_id"]] = min(event["seq"], earliest.get(event["entity_id"], event["seq"]))
+        try:
+            logged = await db.change_log.aggregate([
+                {"$match": {"entity_id": {"$in": list(baselines)}}},
+                {"$group": {"_id": "$entity_id", "seq": {"$min": "$seq"}}}
+            ]).to_list(None)
+        except Exception:
+            logger.exception("Could not check change log baselines, will retry")
+            self.baselines = {**baselines, **self.baselines}
+            return []
+        for entry in logged:
+            earliest[entry["_id"]] = min(entry["seq"], earliest.get(entry["_id"], entry["seq"]))
+        return [baseline for entity_id, baseline in baselines.items() if earliest.get(entity_id, 0) > baseline["seq"]]
+
+    async def flush(self):
+        events, self.events = self.events, []
+        snapshots, self.snapshots = self.snapshots, []
+        snapshots = await self.pending_baselines(events) + snapshots
+        retry_events = await self.write("change_log", events)
+        retry_snapshots = await self.write("change_snapshots", snapshots)
+        # Put back what could not be written, keeping the buffer bounded while MongoDB is unreachable
+        self.events = retry_events + self.events
+        self.snapshots = retry_snapshots + self.snapshots
+        if len(self.events) > self.max_pending:
+            overflow = len(self.events) - self.max_pending
+            self.dropped += overflow
+            logger.error(f"Change log buffer full, dropped {overflow} entries")
+            self.events = self.events[overflow:]
+
+    async def state_at(self, entity_type: str, entity_id: str, at: datetime):
+        """Rebuilds an entity as of a point in time from the nearest snapshot plus later entries."""
+        await self.flush()
+        snapshot = await db.change_snapshots.find_one(
+            {"entity_id": entity_id, "entity_type": entity_type, "at": {"$lte": at}}, {"_id": 0}, sort=[("seq", -1)]
+        )
+        query = {"entity_id": entity_id, "entity_type": entity_type, "at": {"$lte": at}}
+        if snapshot:
+            query["seq"] = {"$gt": snapshot["seq"]}
+        events = await db.change_log.find(query, {"_id": 0}).sort("seq", 1).to_list(None)
+        
+        state = dict(snapshot["state"]) if snapshot else None
+        seq = snapshot["seq"] if snapshot else None
+        for event in events:
+            if event["action"] == "deleted":
+                state = None
+            elif event["action"] == "created":
+                state = dict(event["changes"] or {})
+            elif state is not None:
+                state.update(event["changes"] or {})
+                state["updated_at"] = event["at"]
+            seq = event["seq"]
+        if state is not None:
+            state["version"] = seq
+        return seq, state
+
+change_log = ChangeLog(CHANGE_LOG_BATCH_SIZE, CHANGE_LOG_SNAPSHOT_EVERY, CHANGE_LOG_MAX_PENDING)
+
+async def watch_change_stream():
+    """Publishes equipment and ticket changes from a MongoDB change stream (requires a replica set)."""
+    actions = {"insert": "created", "update": "updated", "replace": "updated", "delete": "deleted"}
+    pipeline = [{"$match": {"ns.coll": {"$in": list(EVENT_TOPICS)}, "operationType": {"$in": list(actions)}}}]
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    topic = change["ns"]["coll"]
+                    document = change.get("fullDocument") or {}
+                    document.pop("_id", None)
+                    if change["operationType"] == "update":
+                        data = change["updateDescription"]["updatedFields"]
+                    else:
+                        data = document or None
+                    owner = document.get("created_by") if topic == "tickets" else None
+                    event_hub.publish(topic, {
+                        "action": actions[change["operationType"]],
+                        "id": document.get("id", str(change["documentKey"]["_id"])),
+                        "data": data
+                    }, owner=owner)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Change stream failed, reconnecting")
+            await asyncio.sleep(5)
+
+class MaintenanceScheduler:
+    """Due-date queue for preventive maintenance, kept in the indexed maintenance_schedule collection.
+
+    Creating a maintenance record with next_maintenance_date (re)schedules its equipment; each tick
+    takes entries that are due and have no ticket yet, oldest first, and opens preventive tickets
+    for them in batches.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+
+    @staticmethod
+    def ticket_id(entry: dict) -> str:
+        # Deterministic per (equipment, due date): workers ticking concurrently collide on the
+        # unique ticket id instead of opening the same ticket twice
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"preventive:{entry['id']}:{entry['due_at'].isoformat()}"))
+
+    async def schedule(self, record: MaintenanceRecord):
+        if record.next_maintenance_date is None:
+            return
+        update = {"$set": {
+            "equipment_id": record.equipment_id,
+            "due_at": record.next_maintenance_date,
+            "maintenance_record_id": record.id,
+            "ticket_id": None
+        }}
+        try:
+            await db.maintenance_schedule.update_one({"id": record.equipment_id}, update, upsert=True)
+        except DuplicateKeyError:
+            # Lost an upsert race on the unique id; the entry exists now
+            await db.maintenance_schedule.update_one({"id": record.equipment_id}, update)
+
+    async def backfill(self):
+        # Seeds the queue from existing records the first time the scheduler runs on a database
+        if await db.maintenance_schedule.find_one({}, {"_id": 1}):
+            return
+        latest = await db.maintenance_records.aggregate([
+            {"$match": {"next_maintenance_date": {"$ne": None}}},
+            {"$sort": {"performed_at": 1}},
+            {"$group": {"_id": "$equipment_id", "due_at": {"$last": "$next_maintenance_date"}, "record_id": {"$last": "$id"}}}
+        ]).to_list(None)
+        for start in range(0, len(latest), self.batch_size):
+            await db.maintenance_schedule.bulk_write([
+                UpdateOne({"id": entry["_id"]}, {"$setOnInsert": {
+                    "equipment_id": entry["_id"],
+                    "due_at": entry["due_at"],
+                    "maintenance_record_id": entry["record_id"],
+                    "ticket_id": None
+                }}, upsert=True)
+                for entry in latest[start:start + self.batch_size]
+            ], ordered=False)
+        if latest:
+            logger.info(f"Maintenance schedule backfilled for {len(latest)} equipment")
+
+    async def tick(self) -> int:
+        created = 0
+        while True:
+            due = await db.maintenance_schedule.find(
+                {"ticket_id": None, "due_at": {"$lte": datetime.utcnow()}}, {"_id": 0}
+            ).sort([("ticket_id", 1), ("due_at", 1), ("id", 1)]).limit(self.batch_size).to_list(self.batch_size)
+            if not due:
+                break
+            batch_created, complete = await self.open_tickets(due)
+            created += batch_created
+            # Stop after a partial batch, or if some entries could not be processed (retried next tick)
+            if len(due) < self.batch_size or not complete:
+                break
+        if created:
+            logger.info(f"Opened {created} preventive maintenance tickets")
+        return created
+
+    async def open_tickets(self, due: List[dict]):
+        equipment_ids = [entry["id"] for entry in due]
+        equipment = {
+            e["id"]: e for e in await db.equipment.find(
+                {"id": {"$in": equipment_ids}}, {"_id": 0, "id": 1, "name": 1, "serial_number": 1, "location": 1, "status": 1}
+            ).to_list(len(equipment_ids))
+        }
+        
+        tickets = []
+        operations = []
+        for entry in due:
+            item = equipment.get(entry["id"])
+            if item is None or item.get("status") == EquipmentStatus.REMOVED:
+                # Nothing to maintain any more
+                operations.append(DeleteOne({"id": entry["id"], "due_at": entry["due_at"]}))
+                continue
+            tickets.append(Ticket(
+                id=self.ticket_id(entry),
+                equipment_id=entry["id"],
+                title=f"Preventive maintenance due: {item['name']}",
+                description=(
+                    f"Scheduled preventive maintenance for {item['name']} (S/N {item['serial_number']}, "
+                    f"{item['location']}) was due on {entry['due_at']:%Y-%m-%d}."
+                ),
+                created_by=SCHEDULER_USER_ID
+            ).dict())
+        
+        inserted = {ticket["id"] for ticket in tickets}
+        failed = set()
+        if tickets:
+            try:
+                await db.tickets.insert_many(tickets, ordered=False)
+            except BulkWriteError as e:
+                for write_error in e.details.get("writeErrors", []):
+                    ticket_id = tickets[write_error["index"]]["id"]
+                    inserted.discard(ticket_id)
+                    # A duplicate means another worker already opened this ticket
+                    if write_error.get("code") != 11000:
+                        failed.add(ticket_id)
+                        logger.error(f"Could not open preventive ticket {ticket_id}: {write_error.get('errmsg')}")
+        
+        due_at = {entry["id"]: entry["due_at"] for entry in due}
+        for ticket in tickets:
+            if ticket["id"] in failed:
+                continue
+            # due_at in the filter keeps a reschedule that landed meanwhile from being marked done
+            operations.append(UpdateOne(
+                {"id": ticket["equipment_id"], "due_at": due_at[ticket["equipment_id"]], "ticket_id": None},
+                {"$set": {"ticket_id": ticket["id"]}}
+            ))
+        if operations:
+            await db.maintenance_schedule.bulk_write(operations, ordered=False)
+        
+        for ticket in tickets:
+            if ticket["id"] in inserted:
+                dashboard_counters.ticket_changed(None, ticket)
+                change_log.record("tickets", ticket["id"], 0, "created", ticket, SCHEDULER_USER_ID)
+                publish_change("tickets", "created", ticket["id"], ticket, owner=ticket["created_by"])
+        return len(inserted), not failed
+
+maintenance_scheduler = MaintenanceScheduler(MAINTENANCE_TICKET_BATCH_SIZE)
+
+class EquipmentArchiver:
+    """Moves removed equipment, its closed tickets and its maintenance records to the *_archive collections.
+
+    Documents are copied (same _id) before they are deleted, children before their equipment,
+    so an interrupted or concurrent run only redoes work: duplicate copies are ignored and the
+    equipment is found again next time. Equipment and tickets get a tombstone before they leave
+    the hot collection, so delta sync clients drop them too, and their attachments are deleted
+    since the attachment routes can no longer reach them.
+    """
+
+    # Collections served by /sync, with the field that scopes their tombstones to an owner
+    TOMBSTONE_OWNERS = {"equipment": None, "tickets": "created_by"}
+
+    def __init__(self, batch_size: int, archive_after: timedelta):
+        self.batch_size = batch_size
+        self.archive_after = archive_after
+        self.archived = {"equipment": 0, "tickets": 0, "maintenance_records": 0, "attachments": 0}
+        self.last_run_at = None
+
+    async def move(self, collection: str, documents: List[dict]) -> int:
+        if not documents:
+            return 0
+        archived_at = datetime.utcnow()
+        try:
+            await db[f"{collection}_archive"].insert_many(
+                [{**document, "archived_at": archived_at} for document in documents], ordered=False
+            )
+        except BulkWriteError as e:
+            if any(write_error.get("code") != 11000 for write_error in e.details.get("writeErrors", [])):
+                raise
+        if collection in self.TOMBSTONE_OWNERS:
+            owner_field = self.TOMBSTONE_OWNERS[collection]
+            # Soft-deleted equipment was already tombstoned by delete_equipment
+            await record_tombstones(collection, [
+                (document["id"], document.get(owner_field) if owner_field else None)
+                for document in documents if document.get("deleted_at") is None
+            ])
+        if collection in {entity.value for entity in AttachmentEntity}:
+            await self.delete_attachments(collection, [document["id"] for document in documents])
+        result = await db[collection].delete_many({"_id": {"$in": [document["_id"] for document in documents]}})
+        self.archived[collection] += result.deleted_count
+        return result.deleted_count
+
+    async def delete_attachments(self, entity_type: str, entity_ids: List[str]):
+        files = await db["attachments.files"].find(
+            {"metadata.entity_type": entity_type, "metadata.entity_id": {"$in": entity_ids}}, {"_id": 1}
+        ).to_list(None)
+        for file_doc in files:
+            try:
+                await get_attachments_bucket().delete(file_doc["_id"])
+            except NoFile:
+                pass
+        self.archived["attachments"] += len(files)
+
+    async def move_all(self, collection: str, query: dict):
+        while True:
+            documents = await db[collection].find(query).limit(self.batch_size).to_list(self.batch_size)
+            await self.move(collection, documents)
+            if len(documents) < self.batch_size:
+                return
+
+    async def run(self) -> int:
+        cutoff = datetime.utcnow() - self.archive_after
+        # Soft-deleted equipment, or equipment whose status was set to removed with a past removal date
+        query = {"status": EquipmentStatus.REMOVED, "$or": [
+            {"deleted_at": {"$lte": cutoff}},
+            {"deleted_at": None, "removal_date": {"$lte": cutoff}}
+        ]}
+        moved = 0
+        while True:
+            equipment = await db.equipment.find(query).limit(self.batch_size).to_list(self.batch_size)
+            if not equipment:
+                break
+            equipment_ids = [item["id"] for item in equipment]
+            # Open tickets stay in the hot collection until someone closes them
+            await self.move_all("tickets", {
+                "equipment_id": {"$in": equipment_ids},
+                "status": {"$in": [TicketStatus.RESOLVED, TicketStatus.CLOSED]}
+            })
+            await self.move_all("maintenance_records", {"equipment_id": {"$in": equipment_ids}})
+            moved += await self.move("equipment", equipment)
+            for item in equipment:
+                if item.get("deleted_at") is None:
+                    # Still counted until now; soft-deleted equipment already left the counters
+                    dashboard_counters.equipment_changed(item, None)
+                response_cache.invalidate(f"maintenance:{item['id']}")
+                invalidate_equipment(item["id"])
+            if len(equipment) < self.batch_size:
+                break
+        self.last_run_at = datetime.utcnow()
+        if moved:
+            logger.info(f"Archived {moved} removed equipment")
+        return moved
+
+    def stats(self) -> dict:
+        return {
+            "archived": self.archived,
+            "archive_after_days": self.archive_after.total_seconds() / 86400,
+            "retention_days": ARCHIVE_RETENTION_DAYS,
+            "last_run_at": self.last_run_at
+        }
+
+equipment_archiver = EquipmentArchiver(ARCHIVE_BATCH_SIZE, timedelta(days=ARCHIVE_AFTER_DAYS))
+
+# Per-month partial aggregates behind the reports: documents whose date_field falls in a month
+# are grouped by month and key, keeping only sums and counts so any set of months can be merged
+REPORT_SPECS = {
+    "maintenance_cost": {
+        "collection": "maintenance_records",
+        "date_field": "performed_at",
+        "match": {},
+        "key": {"equipment_id": "$equipment_id"},
+        "values": {"cost": {"$sum": {"$ifNull": ["$cost", 0]}}, "records": {"$sum": 1}}
+    },
+    "ticket_resolution": {
+        "collection": "tickets",
+        "date_field": "resolved_at",
+        "match": {"created_at": {"$ne": None}},
+        "key": {"priority": "$priority"},
+        "values": {
+            "seconds": {"$sum": {"$divide": [{"$subtract": ["$resolved_at", "$created_at"]}, 1000]}},
+            "tickets": {"$sum": 1}
+        }
+    },
+    "failures": {
+        "collection": "tickets",
+        "date_field": "created_at",
+        # Scheduled preventive tickets are not failures
+        "match": {"created_by": {"$ne": SCHEDULER_USER_ID}},
+        "key": {"equipment_id": "$equipment_id"},
+        "values": {"failures": {"$sum": 1}}
+    }
+}
+
+def add_months(month: datetime, count: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def report_months(start: Optional[str], end: Optional[str]) -> List[datetime]:
+    # start and end are inclusive YYYY-MM months; the default is the last REPORT_DEFAULT_MONTHS
+    now = datetime.utcnow()
+    try:
+        last = datetime.strptime(end, "%Y-%m") if end else datetime(now.year, now.month, 1)
+        first = datetime.strptime(start, "%Y-%m") if start else add_months(last, 1 - REPORT_DEFAULT_MONTHS)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Months must be given as YYYY-MM")
+    count = (last.year - first.year) * 12 + last.month - first.month + 1
+    if count < 1 or count > REPORT_MAX_MONTHS:
+        raise HTTPException(status_code=400, detail=f"A report covers 1 to {REPORT_MAX_MONTHS} months")
+    return [add_months(first, offset) for offset in range(count)]
+
+def merge_rows(rows: List[dict], key: str, values: List[str]) -> dict:
+    merged = {}
+    for row in rows:
+        totals = merged.setdefault(row[key], dict.fromkeys(values, 0))
+        for value in values:
+            totals[value] += row[value]
+    return merged
+
+class ReportEngine:
+    """Aggregates REPORT_SPECS in MongoDB and keeps the partial rows of closed months in report_snapshots.
+
+    Only months without a snapshot (and the open ones) are aggregated, in a single pipeline;
+    Python never sees more than one row per month and key.
+    """
+
+    def __init__(self):
+        self.aggregated_months = 0
+        self.cached_months = 0
+
+    async def monthly_rows(self, report: str, months: List[datetime], refresh: bool = False):
+        """Returns (rows, months served from snapshots); each row has "month", the spec's key and values."""
+        spec = REPORT_SPECS[report]
+        closed_before = datetime.utcnow() - REPORT_CLOSE_GRACE
+        closed = {month.strftime("%Y-%m") for month in months if add_months(month, 1) <= closed_before}
+        
+        snapshots = {}
+        if closed and not refresh:
+            async for snapshot in db.report_snapshots.find({"_id": {"$in": [f"{report}:{month}" for month in closed]}}):
+                snapshots[snapshot["month"]] = snapshot["rows"]
+        rows = [row for month_rows in snapshots.values() for row in month_rows]
+        
+        missing = [month for month in months if month.strftime("%Y-%m") not in snapshots]
+        if missing:
+            computed = await self.aggregate(spec, missing)
+            rows.extend(computed)
+            by_month = {month.strftime("%Y-%m"): [] for month in missing}
+            for row in computed:
+                by_month[row["month"]].append(row)
+            # Empty closed months are stored too, so they are never aggregated again
+            writes = [
+                ReplaceOne(
+                    {"_id": f"{report}:{month}"},
+                    {"report": report, "month": month, "rows": month_rows, "computed_at": datetime.utcnow()},
+                    upsert=True
+                )
+                for month, month_rows in by_month.items() if month in closed
+            ]
+            if writes:
+                await db.report_snapshots.bulk_write(writes, ordered=False)
+        
+        self.aggregated_months += len(missing)
+        self.cached_months += len(snapshots)
+        return rows, len(snapshots)
+
+    async def aggregate(self, spec: dict, months: List[datetime]) -> List[dict]:
+        # Consecutive months become one range, so the match stays a handful of index range scans
+        ranges = []
+        for month in months:
+            if ranges and ranges[-1][1] == month:
+                ranges[-1][1] = add_months(month, 1)
+            else:
+                ranges.append([month, add_months(month, 1)])
+        date_field = spec["date_field"]
+        date_match = [{date_field: {"$gte": start, "$lt": end}} for start, end in ranges]
+        
+        pipeline = [
+            {"$match": {**spec["match"], **(date_match[0] if len(date_match) == 1 else {"$or": date_match})}},
+            {"$group": {
+                "_id": {"month": {"$dateToString": {"format": "%Y-%m", "date": f"${date_field}"}}, **spec["key"]},
+                **spec["values"]
+            }}
+        ]
+        results = await db[spec["collection"]].aggregate(pipeline).to_list(None)
+        return [{**result.pop("_id"), **result} for result in results]
+
+report_engine = ReportEngine()
+
+async def equipment_details(equipment_ids, fields: List[str]) -> dict:
+    equipment = await db.equipment.find(
+        {"id": {"$in": list(equipment_ids)}}, {"_id": 0, "id": 1, **{field: 1 for field in fields}}
+    ).to_list(None)
+    return {item["id"]: item for item in equipment}
+
+# Health
+@api_router.get("/health")
+async def health():
+    # Readiness: the worker is up and can reach MongoDB
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=HEALTH_CHECK_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Health check failed: {e!r}")
+        return Response(
+            content=json.dumps({"status": "unavailable", "mongo": "unreachable"}),
+            status_code=503,
+            media_type="application/json"
+        )
+    return {"status": "ok", "mongo": "ok", "pid": os.getpid()}
+
 # Auth Routes
 @api_router.post("/register", response_model=UserResponse)
 async def register(user_data: UserCreate):
@@ -203,7 +2372,7 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Username or email already exists")
     
     # Hash password
-    password_hash = hash_password(user_data.password)
+    password_hash = await password_hasher.hash(user_data.password)
     
     # Create user
     user_dict = user_data.dict()
@@ -211,15 +2380,31 @@ async def register(user_data: UserCreate):
     user_dict['password_hash'] = password_hash
     user_obj = User(**user_dict)
     
-    await db.users.insert_one(user_obj.dict())
+    try:
+        await db.users.insert_one(user_obj.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username or email already exists")
+    user_cache.invalidate(user_obj.id)
+    dashboard_counters.adjust("total_users", 1)
     return UserResponse(**user_obj.dict())
 
 @api_router.post("/login")
-async def login(user_data: UserLogin):
+async def login(user_data: UserLogin, request: Request):
+    # Rate limits are checked before any bcrypt work is queued
+    await login_ip_limiter.check(client_ip(request))
+    await login_username_limiter.check(user_data.username, hit=False)
+    
     user = await db.users.find_one({"username": user_data.username})
-    if not user or not verify_password(user_data.password, user['password_hash']):
+    if user:
+        verified = await password_hasher.verify(user_data.password, user['password_hash'])
+    else:
+        verified = await password_hasher.verify_unknown_user(user_data.password)
+    if not verified:
+        await login_username_limiter.hit(user_data.username)
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    await login_username_limiter.reset(user_data.username)
+    
     token = create_jwt_token(user['id'], user['role'])
     return {
         "access_token": token,
@@ -238,49 +2423,282 @@ async def create_equipment(equipment_data: EquipmentCreate, current_user: UserRe
     equipment_dict['created_by'] = current_user.id
     equipment_obj = Equipment(**equipment_dict)
     
-    await db.equipment.insert_one(equipment_obj.dict())
+    try:
+        await db.equipment.insert_one({**equipment_obj.dict(), **equipment_search_keys(equipment_obj.dict())})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Serial number already exists")
+    dashboard_counters.equipment_changed(None, equipment_obj.dict())
+    change_log.record("equipment", equipment_obj.id, 0, "created", equipment_obj.dict(), current_user.id)
+    invalidate_equipment(equipment_obj.id)
+    publish_change("equipment", "created", equipment_obj.id, equipment_obj.dict())
     return equipment_obj
 
-@api_router.get("/equipment", response_model=List[Equipment])
-async def get_equipment(current_user: UserResponse = Depends(get_current_user)):
-    equipment_list = await db.equipment.find().to_list(1000)
-    return [Equipment(**equipment) for equipment in equipment_list]
+@api_router.get("/equipment", response_model=Union[List[Equipment], EquipmentPage])
+async def get_equipment(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_read_principal)
+):
+    # Every reader sees the same equipment, so one cached copy serves all of them
+    return await cached_response(
+        request, "all", ["equipment"],
+        lambda: list_or_page(Equipment, db.equipment, LIVE_EQUIPMENT, "created_at", limit, cursor)
+    )
 
-@api_router.get("/equipment/{equipment_id}", response_model=Equipment)
-async def get_equipment_by_id(equipment_id: str, current_user: UserResponse = Depends(get_current_user)):
-    equipment = await db.equipment.find_one({"id": equipment_id})
-    if not equipment:
+@api_router.get("/equipment/search", response_model=EquipmentSearchResult)
+async def search_equipment(
+    request: Request,
+    q: Optional[str] = None,
+    status: Optional[EquipmentStatus] = None,
+    location: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    current_user: Principal = Depends(get_read_principal)
+):
+    return await cached_response(
+        request, "all", ["equipment"],
+        lambda: run_equipment_search(q, status, location, offset, limit)
+    )
+
+async def aggregate_equipment_search(match: dict, scored: bool, status_filter: dict, location_filter: dict, offset: int, limit: int) -> dict:
+    # The shared match has to be the first stage (a $text search must be); the other filters
+    # are applied per facet so each facet counts values across the remaining filters
+    if scored:
+        sort_stage = {"score": -1, "name": 1, "id": 1}
+        score_stage = [{"$addFields": {"score": {"$meta": "textScore"}}}]
+    else:
+        sort_stage = {"name": 1, "id": 1}
+        score_stage = []
+    
+    pipeline = [
+        {"$match": {**match, **LIVE_EQUIPMENT}},
+        {"$facet": {
+            "items": [
+                {"$match": {**status_filter, **location_filter}},
+                *score_stage,
+                {"$sort": sort_stage},
+                {"$skip": offset},
+                {"$limit": limit},
+                {"$project": model_projection(EquipmentSearchHit)}
+            ],
+            "total": [
+                {"$match": {**status_filter, **location_filter}},
+                {"$count": "count"}
+            ],
+            "status": [
+                {"$match": location_filter},
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}}
+            ],
+            "location": [
+                {"$match": status_filter},
+                {"$group": {"_id": "$location", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": 50}
+            ]
+        }}
+    ]
+    results = await db.equipment.aggregate(pipeline).to_list(1)
+    return results[0] if results else {"items": [], "total": [], "status": [], "location": []}
+
+async def run_equipment_search(q: Optional[str], status: Optional[EquipmentStatus], location: Optional[str], offset: int, limit: int):
+    text = q.strip() if q else ""
+    status_filter = {"status": status.value} if status else {}
+    location_filter = {"location": location} if location else {}
+    
+    if text:
+        result = await aggregate_equipment_search({"$text": {"$search": text}}, True, status_filter, location_filter, offset, limit)
+        # $text only matches whole (stemmed) words, so a last word still being typed finds nothing;
+        # a trailing space means it is complete, otherwise fall back to an indexed prefix match
+        # on the lowercased name and serial number
+        if not result["total"] and not q[-1].isspace():
+            prefix = {"$regex": f"^{re.escape(text.lower())}"}
+            result = await aggregate_equipment_search(
+                {"$or": [{"name_lower": prefix}, {"serial_lower": prefix}]}, False, status_filter, location_filter, offset, limit
+            )
+    else:
+        result = await aggregate_equipment_search({}, False, status_filter, location_filter, offset, limit)
+    
+    return ORJSONResponse({
+        "items": fast_items(result["items"], model_defaults(EquipmentSearchHit)),
+        "total": result["total"][0]["count"] if result["total"] else 0,
+        "offset": offset,
+        "limit": limit,
+        "facets": {
+            "status": [{"value": str(f["_id"]), "count": f["count"]} for f in result["status"]],
+            "location": [{"value": str(f["_id"]), "count": f["count"]} for f in result["location"]]
+        }
+    })
+
+@api_router.post("/equipment/import", response_model=EquipmentImportReport)
+async def import_equipment(
+    request: Request,
+    import_format: Optional[str] = Query(None, alias="format", pattern="^(csv|ndjson)$"),
+    current_user: UserResponse = Depends(get_admin_user)
+):
+    if import_format is None:
+        content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        import_format = IMPORT_CONTENT_TYPES.get(content_type)
+    if import_format is None:
+        raise HTTPException(status_code=415, detail="Send text/csv or application/x-ndjson, or pass ?format=")
+    
+    importer = EquipmentImporter(current_user.id)
+    async for row_number, row in iter_import_rows(iter_request_lines(request), import_format):
+        await importer.add(row_number, row)
+    await importer.finish()
+    importer.report.errors.sort(key=lambda e: e.row)
+    return importer.report
+
+@api_router.get("/equipment/export")
+async def export_equipment(
+    export_format: str = Query("ndjson", alias="format", pattern="^(csv|ndjson)$"),
+    current_user: Principal = Depends(get_read_principal)
+):
+    fields = list(Equipment.model_fields)
+    
+    async def generate():
+        cursor = db.equipment.find(LIVE_EQUIPMENT, {"_id": 0}).sort([("created_at", 1), ("id", 1)]).batch_size(EXPORT_BATCH_SIZE)
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(fields)
+            async for equipment in cursor:
+                writer.writerow([export_value(equipment.get(field)) for field in fields])
+                if buffer.tell() >= 65536:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            async for equipment in cursor:
+                yield json.dumps({field: equipment.get(field) for field in fields}, default=export_value) + "\n"
+    
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="equipment.{export_format}"'}
+    return StreamingResponse(generate(), media_type=media_type, headers=headers)
+
+@api_router.get("/equipment/by-serial/{serial_number:path}", response_model=Equipment)
+async def get_equipment_by_serial(serial_number: str, current_user: Principal = Depends(get_read_principal)):
+    # Taken literally: QR payloads are only decoded by /equipment/lookup
+    found = await resolve_equipment({serial_number: ("serial_number", serial_number)})
+    if not found:
         raise HTTPException(status_code=404, detail="Equipment not found")
-    return Equipment(**equipment)
+    return ORJSONResponse(next(iter(found.values())))
 
-@api_router.put("/equipment/{equipment_id}", response_model=Equipment)
-async def update_equipment(equipment_id: str, equipment_data: EquipmentUpdate, current_user: UserResponse = Depends(get_current_user)):
-    equipment = await db.equipment.find_one({"id": equipment_id})
+@api_router.post("/equipment/lookup", response_model=EquipmentLookupResult)
+async def lookup_equipment_codes(lookup: EquipmentLookupRequest, current_user: Principal = Depends(get_read_principal)):
+    # Batch form for scanning many labels; accepts serial numbers and QR payloads mixed
+    found = await lookup_equipment(lookup.codes)
+    return ORJSONResponse({
+        "found": found,
+        "missing": [code for code in dict.fromkeys(lookup.codes) if code not in found]
+    })
+
+@api_router.get("/equipment/{equipment_id}/qr", response_model=EquipmentQRCode)
+async def get_equipment_qr(equipment_id: str, current_user: Principal = Depends(get_read_principal)):
+    equipment = await db.equipment.find_one({"id": equipment_id, **LIVE_EQUIPMENT}, {"_id": 0, "id": 1, "serial_number": 1})
     if not equipment:
         raise HTTPException(status_code=404, detail="Equipment not found")
+    return EquipmentQRCode(equipment_id=equipment["id"], serial_number=equipment["serial_number"], payload=qr_payload(equipment["id"]))
+
+@api_router.get("/equipment/{equipment_id}", response_model=Equipment)
+async def get_equipment_by_id(equipment_id: str, request: Request, current_user: Principal = Depends(get_read_principal)):
+    async def build():
+        equipment = await db.equipment.find_one({"id": equipment_id, **LIVE_EQUIPMENT}, model_projection(Equipment))
+        if not equipment:
+            raise HTTPException(status_code=404, detail="Equipment not found")
+        return ORJSONResponse(fast_items([equipment], model_defaults(Equipment))[0])
     
+    return await cached_response(request, "all", [f"equipment:{equipment_id}"], build)
+
+@api_router.get("/equipment/{equipment_id}/timeline", response_model=ChangeEventPage)
+async def get_equipment_timeline(
+    equipment_id: str,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_read_principal)
+):
+    # Newest first; the cursor is the last seq returned. Deleted equipment keeps its history.
+    await change_log.flush()
+    query = {"entity_id": equipment_id, "entity_type": "equipment"}
+    if cursor is not None:
+        if not cursor.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["seq"] = {"$lt": int(cursor)}
+    events = await db.change_log.find(query, {"_id": 0}).sort("seq", -1).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(events) > limit:
+        events = events[:limit]
+        next_cursor = str(events[-1]["seq"])
+    return ORJSONResponse({"items": events, "next_cursor": next_cursor})
+
+@api_router.get("/equipment/{equipment_id}/state", response_model=EquipmentState)
+async def get_equipment_state(equipment_id: str, at: datetime, current_user: Principal = Depends(get_read_principal)):
+    # Stored times are naive UTC
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    seq, state = await change_log.state_at("equipment", equipment_id, at)
+    return ORJSONResponse({"at": at, "seq": seq, "state": state})
+
+@api_router.put("/equipment/{equipment_id}", response_model=Equipment)
+async def update_equipment(equipment_id: str, equipment_data: EquipmentUpdate, current_user: UserResponse = Depends(get_current_user)):
     update_data = {k: v for k, v in equipment_data.dict().items() if v is not None}
     update_data['updated_at'] = datetime.utcnow()
     
-    await db.equipment.update_one({"id": equipment_id}, {"$set": update_data})
+    # Take the pre-image so the counters see the old status; the update is a plain $set,
+    # so the post-image is the pre-image with update_data applied
+    try:
+        equipment = await db.equipment.find_one_and_update(
+            {"id": equipment_id, **LIVE_EQUIPMENT},
+            {"$set": {**update_data, **equipment_search_keys(update_data)}, "$inc": {"version": 1}},
+            projection=model_projection(Equipment),
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Serial number already exists")
     
-    updated_equipment = await db.equipment.find_one({"id": equipment_id})
+    if not equipment:
+        raise HTTPException(status_code=404, detail="Equipment not found")
+    updated_equipment = {**equipment, **update_data, "version": equipment.get("version", 0) + 1}
+    dashboard_counters.equipment_changed(equipment, updated_equipment)
+    change_log.record(
+        "equipment", equipment_id, updated_equipment["version"], "updated", update_data, current_user.id,
+        updated_equipment, previous=equipment
+    )
+    invalidate_equipment(equipment_id)
+    publish_change("equipment", "updated", equipment_id, update_data)
     return Equipment(**updated_equipment)
 
 @api_router.delete("/equipment/{equipment_id}")
 async def delete_equipment(equipment_id: str, current_user: UserResponse = Depends(get_admin_user)):
-    equipment = await db.equipment.find_one({"id": equipment_id})
+    # Soft delete: the equipment is marked removed and hidden; the archiver later moves it,
+    # with its closed tickets and maintenance history, out of the hot collections
+    now = datetime.utcnow()
+    equipment = await db.equipment.find_one_and_update(
+        {"id": equipment_id, **LIVE_EQUIPMENT},
+        {
+            "$set": {"status": EquipmentStatus.REMOVED, "deleted_at": now, "updated_at": now},
+            "$inc": {"version": 1}
+        },
+        projection={"_id": 0, "status": 1, "version": 1},
+        return_document=ReturnDocument.BEFORE
+    )
     if not equipment:
         raise HTTPException(status_code=404, detail="Equipment not found")
     
-    await db.equipment.delete_one({"id": equipment_id})
+    await record_tombstone("equipment", equipment_id)
+    dashboard_counters.equipment_changed(equipment, None)
+    change_log.record("equipment", equipment_id, equipment.get("version", 0) + 1, "deleted", actor=current_user.id)
+    invalidate_equipment(equipment_id)
+    publish_change("equipment", "deleted", equipment_id)
     return {"message": "Equipment deleted successfully"}
 
 # Ticket Routes
 @api_router.post("/tickets", response_model=Ticket)
 async def create_ticket(ticket_data: TicketCreate, current_user: UserResponse = Depends(get_current_user)):
     # Check if equipment exists
-    equipment = await db.equipment.find_one({"id": ticket_data.equipment_id})
+    equipment = await db.equipment.find_one({"id": ticket_data.equipment_id, **LIVE_EQUIPMENT}, {"_id": 1})
     if not equipment:
         raise HTTPException(status_code=404, detail="Equipment not found")
     
@@ -289,19 +2707,28 @@ async def create_ticket(ticket_data: TicketCreate, current_user: UserResponse =
     ticket_obj = Ticket(**ticket_dict)
     
     await db.tickets.insert_one(ticket_obj.dict())
+    dashboard_counters.ticket_changed(None, ticket_obj.dict())
+    change_log.record("tickets", ticket_obj.id, 0, "created", ticket_obj.dict(), current_user.id)
+    publish_change("tickets", "created", ticket_obj.id, ticket_obj.dict(), owner=ticket_obj.created_by)
     return ticket_obj
 
-@api_router.get("/tickets", response_model=List[Ticket])
-async def get_tickets(current_user: UserResponse = Depends(get_current_user)):
+@api_router.get("/tickets", response_model=Union[List[Ticket], TicketPage])
+async def get_tickets(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    expand: Optional[str] = Query(None, description="Comma-separated: equipment, created_by, assigned_to"),
+    current_user: Principal = Depends(get_read_principal)
+):
+    expansions = parse_expand(expand, {"equipment", "created_by", "assigned_to"})
     if current_user.role == UserRole.ADMIN:
-        tickets = await db.tickets.find().to_list(1000)
+        query = {}
     else:
-        tickets = await db.tickets.find({"created_by": current_user.id}).to_list(1000)
+        query = {"created_by": current_user.id}
     
-    return [Ticket(**ticket) for ticket in tickets]
+    return await list_or_page(Ticket, db.tickets, query, "created_at", limit, cursor, expansions)
 
 @api_router.get("/tickets/{ticket_id}", response_model=Ticket)
-async def get_ticket_by_id(ticket_id: str, current_user: UserResponse = Depends(get_current_user)):
+async def get_ticket_by_id(ticket_id: str, response: Response, current_user: Principal = Depends(get_read_principal)):
     ticket = await db.tickets.find_one({"id": ticket_id})
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
@@ -310,17 +2737,25 @@ async def get_ticket_by_id(ticket_id: str, current_user: UserResponse = Depends(
     if current_user.role != UserRole.ADMIN and ticket['created_by'] != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
     
+    response.headers["ETag"] = ticket_etag(ticket)
     return Ticket(**ticket)
 
 @api_router.put("/tickets/{ticket_id}", response_model=Ticket)
-async def update_ticket(ticket_id: str, ticket_data: TicketUpdate, current_user: UserResponse = Depends(get_current_user)):
-    ticket = await db.tickets.find_one({"id": ticket_id})
-    if not ticket:
-        raise HTTPException(status_code=404, detail="Ticket not found")
-    
-    # Check permissions
-    if current_user.role != UserRole.ADMIN and ticket['created_by'] != current_user.id:
-        raise HTTPException(status_code=403, detail="Access denied")
+async def update_ticket(
+    ticket_id: str,
+    ticket_data: TicketUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    # Permission and version checks are part of the filter, so the happy path is a single round trip
+    query = {"id": ticket_id}
+    if current_user.role != UserRole.ADMIN:
+        query["created_by"] = current_user.id
+    expected_version = parse_if_match(if_match)
+    if expected_version is not None:
+        # Tickets written before versioning have no version field and count as version 0
+        query["version"] = {"$in": [0, None]} if expected_version == 0 else expected_version
     
     update_data = {k: v for k, v in ticket_data.dict().items() if v is not None}
     update_data['updated_at'] = datetime.utcnow()
@@ -328,16 +2763,357 @@ async def update_ticket(ticket_id: str, ticket_data: TicketUpdate, current_user:
     if update_data.get('status') == TicketStatus.RESOLVED:
         update_data['resolved_at'] = datetime.utcnow()
     
-    await db.tickets.update_one({"id": ticket_id}, {"$set": update_data})
+    # Pre-image keeps the old status for the dashboard counters; the post-image is derived from it
+    ticket = await db.tickets.find_one_and_update(
+        query,
+        {"$set": update_data, "$inc": {"version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+    
+    if not ticket:
+        # Work out why the filter did not match
+        ticket = await db.tickets.find_one({"id": ticket_id}, {"created_by": 1, "version": 1})
+        if not ticket:
+            raise HTTPException(status_code=404, detail="Ticket not found")
+        if current_user.role != UserRole.ADMIN and ticket['created_by'] != current_user.id:
+            raise HTTPException(status_code=403, detail="Access denied")
+        raise HTTPException(status_code=412, detail="Ticket was modified by someone else", headers={"ETag": ticket_etag(ticket)})
     
-    updated_ticket = await db.tickets.find_one({"id": ticket_id})
+    updated_ticket = {**ticket, **update_data, "version": ticket.get("version", 0) + 1}
+    dashboard_counters.ticket_changed(ticket, updated_ticket)
+    change_log.record(
+        "tickets", ticket_id, updated_ticket["version"], "updated", update_data, current_user.id,
+        updated_ticket, previous=ticket
+    )
+    publish_change(
+        "tickets", "updated", ticket_id,
+        {**update_data, "version": updated_ticket["version"]},
+        owner=updated_ticket["created_by"]
+    )
+    response.headers["ETag"] = ticket_etag(updated_ticket)
     return Ticket(**updated_ticket)
 
+# Sync Routes
+@api_router.get("/sync", response_model=SyncResponse)
+async def sync_changes(since: Optional[str] = None, current_user: Principal = Depends(get_read_principal)):
+    # Without a token this is a full download; either way, large change sets come back in batches
+    # (has_more=true) that all share one upper bound, and the last batch's token opens the next window
+    state = decode_sync_token(since) if since else {"since": None, "until": None, "pending": {}}
+    since_time = state["since"]
+    if since_time and since_time < datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        raise HTTPException(status_code=410, detail="Sync token expired, a full sync is required")
+    until = state["until"] or datetime.utcnow()
+    
+    window = {"$lte": until}
+    if since_time:
+        window["$gt"] = since_time
+    is_admin = current_user.role == UserRole.ADMIN
+    ticket_scope = {} if is_admin else {"created_by": current_user.id}
+    tombstone_scope = {} if is_admin else {"$or": [{"collection": "equipment"}, {"owner": current_user.id}]}
+    sources = {
+        # Soft-deleted equipment reaches clients as a tombstone instead
+        "equipment": (db.equipment, {"updated_at": window, **LIVE_EQUIPMENT}, "updated_at", model_projection(Equipment)),
+        "tickets": (db.tickets, {**ticket_scope, "updated_at": window}, "updated_at", model_projection(Ticket)),
+    }
+    # A full download has nothing to delete on the client
+    if since_time:
+        sources["tombstones"] = (db.tombstones, {**tombstone_scope, "deleted_at": window}, "deleted_at", {"_id": 0, "collection": 1, "id": 1, "deleted_at": 1})
+    
+    pending = state["pending"] if state["until"] else {name: None for name in sources}
+    names = [name for name in sources if name in pending]
+    fetches = []
+    for name in names:
+        collection, query, sort_field, projection = sources[name]
+        fetches.append(fetch_page(collection, query, sort_field, SYNC_BATCH_SIZE, pending[name], projection=projection))
+    pages = await asyncio.gather(*fetches)
+    
+    results = {"equipment": [], "tickets": [], "tombstones": []}
+    next_pending = {}
+    for name, (documents, next_cursor) in zip(names, pages):
+        results[name] = documents
+        if next_cursor:
+            next_pending[name] = next_cursor
+    
+    deleted = {"equipment": [], "tickets": []}
+    for tombstone in results["tombstones"]:
+        deleted.setdefault(tombstone["collection"], []).append(tombstone["id"])
+    
+    if next_pending:
+        token = {"since": since_time, "until": until, "pending": next_pending}
+    else:
+        token = {"since": until - timedelta(seconds=SYNC_OVERLAP_SECONDS)}
+    return ORJSONResponse({
+        "equipment": fast_items(results["equipment"], model_defaults(Equipment)),
+        "tickets": fast_items(results["tickets"], model_defaults(Ticket)),
+        "deleted": deleted,
+        "sync_token": encode_sync_token(token),
+        "has_more": bool(next_pending)
+    })
+
+@api_router.patch("/tickets:batch", response_model=TicketBatchResponse)
+async def batch_update_tickets(batch: TicketBatchUpdate, current_user: UserResponse = Depends(get_current_user)):
+    if batch.ids and (batch.update is None or not batch.update.dict(exclude_none=True)):
+        raise HTTPException(status_code=400, detail="ids need an update that sets at least one field")
+    items = batch.items + [TicketBatchItem(id=ticket_id, **batch.update.dict()) for ticket_id in batch.ids]
+    if not items:
+        raise HTTPException(status_code=400, detail="Send items, or ids with an update")
+    if len(items) > TICKET_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {TICKET_BATCH_MAX_ITEMS} tickets per batch")
+    
+    # One read for existence, permissions and pre-images (for the counters and versions)
+    tickets = {
+        ticket["id"]: ticket for ticket in await db.tickets.find(
+            {"id": {"$in": list({item.id for item in items})}}, {"_id": 0}
+        ).to_list(None)
+    }
+    
+    now = datetime.utcnow()
+    # Stamped on every write of this request, so a partial bulk_write can tell which writes landed
+    batch_token = str(uuid.uuid4())
+    seen = set()
+    duplicates = {item.id for item in items if item.id in seen or seen.add(item.id)}
+    results = {}
+    planned = {}
+    operations = []
+    for item in items:
+        ticket = tickets.get(item.id)
+        if item.id in duplicates:
+            results[item.id] = {"id": item.id, "status": 400, "error": "Ticket listed more than once"}
+            continue
+        update_data = {k: v for k, v in item.dict(exclude={"id", "version"}).items() if v is not None}
+        if not update_data:
+            results[item.id] = {"id": item.id, "status": 400, "error": "Update sets no fields"}
+            continue
+        if ticket is None:
+            results[item.id] = {"id": item.id, "status": 404, "error": "Ticket not found"}
+            continue
+        if current_user.role != UserRole.ADMIN and ticket['created_by'] != current_user.id:
+            results[item.id] = {"id": item.id, "status": 403, "error": "Access denied"}
+            continue
+        version = ticket.get("version", 0)
+        if item.version is not None and item.version != version:
+            results[item.id] = {"id": item.id, "status": 412, "error": "Ticket was modified by someone else"}
+            continue
+        
+        update_data['updated_at'] = now
+        if update_data.get('status') == TicketStatus.RESOLVED:
+            update_data['resolved_at'] = now
+        
+        # Filtering on the version that was read makes each write conditional, like If-Match
+        planned[item.id] = update_data
+        operations.append(UpdateOne(
+            {"id": item.id, "version": {"$in": [0, None]} if version == 0 else version},
+            {"$set": {**update_data, "batch_token": batch_token}, "$inc": {"version": 1}}
+        ))
+    
+    if operations:
+        result = await db.tickets.bulk_write(operations, ordered=False)
+        applied = set(planned)
+        if result.matched_count < len(operations):
+            # Some tickets changed between the read and the write; find out which writes landed
+            current = await db.tickets.find({"id": {"$in": list(planned)}, "batch_token": batch_token}, {"_id": 0, "id": 1}).to_list(None)
+            applied &= {ticket["id"] for ticket in current}
+        
+        for ticket_id, update_data in planned.items():
+            if ticket_id not in applied:
+                results[ticket_id] = {"id": ticket_id, "status": 412, "error": "Ticket was modified by someone else"}
+                continue
+            ticket = tickets[ticket_id]
+            updated_ticket = {**ticket, **update_data, "version": ticket.get("version", 0) + 1}
+            dashboard_counters.ticket_changed(ticket, updated_ticket)
+            change_log.record(
+                "tickets", ticket_id, updated_ticket["version"], "updated", update_data, current_user.id,
+                updated_ticket, previous=ticket
+            )
+            publish_change(
+                "tickets", "updated", ticket_id,
+                {**update_data, "version": updated_ticket["version"]},
+                owner=updated_ticket["created_by"]
+            )
+            results[ticket_id] = {"id": ticket_id, "status": 200, "ticket": Ticket(**updated_ticket)}
+    
+    ordered = [results[ticket_id] for ticket_id in dict.fromkeys(item.id for item in items)]
+    updated = sum(1 for result in ordered if result["status"] == 200)
+    return {"updated": updated, "failed": len(ordered) - updated, "results": ordered}
+
+# Real-time Events
+@api_router.websocket("/ws/events")
+async def events_websocket(websocket: WebSocket, topics: str = Query("equipment,tickets")):
+    # Browsers cannot set an Authorization header on WebSockets, so the JWT rides in the subprotocol
+    # list instead: new WebSocket(url, ["bearer", token]). Unlike a query parameter it is never logged.
+    protocols = [protocol.strip() for protocol in websocket.headers.get("sec-websocket-protocol", "").split(",")]
+    if len(protocols) != 2 or protocols[0] != "bearer":
+        await websocket.close(code=1008)
+        return
+    try:
+        payload = decode_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=protocols[1]))
+        user = await load_user(payload["user_id"])
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept(subprotocol="bearer")
+    subscription = event_hub.subscribe(user, {topic.strip() for topic in topics.split(",")} & EVENT_TOPICS)
+    
+    async def send_events():
+        while True:
+            message = await subscription.queue.get()
+            if message is None:
+                await websocket.close(code=1013, reason="Consumer too slow")
+                return
+            await websocket.send_text(message)
+    
+    async def wait_for_disconnect():
+        # Incoming messages are ignored; reading them is how a disconnect is noticed while idle
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    
+    tasks = {asyncio.create_task(send_events()), asyncio.create_task(wait_for_disconnect())}
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = None if task.cancelled() else task.exception()
+            if error and not isinstance(error, WebSocketDisconnect):
+                logger.warning(f"Event socket closed with error: {error!r}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        event_hub.unsubscribe(subscription)
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(limit: int = Query(20, ge=1, le=200), current_user: UserResponse = Depends(get_admin_user)):
+    return query_profiler.top(limit)
+
+@api_router.get("/admin/archive")
+async def get_archive_stats(current_user: UserResponse = Depends(get_admin_user)):
+    return equipment_archiver.stats()
+
+@api_router.post("/admin/archive/run")
+async def run_archiver(current_user: UserResponse = Depends(get_admin_user)):
+    moved = await equipment_archiver.run()
+    return {"archived_equipment": moved, **equipment_archiver.stats()}
+
+@api_router.get("/admin/events")
+async def get_event_hub_stats(current_user: UserResponse = Depends(get_admin_user)):
+    return event_hub.stats()
+
+# Attachment Routes
+@api_router.post("/{entity_type}/{entity_id}/attachments", response_model=Attachment)
+async def upload_attachment(
+    entity_type: AttachmentEntity,
+    entity_id: str,
+    request: Request,
+    filename: str = Query(..., min_length=1, max_length=255),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    # The raw request body is streamed into GridFS chunk by chunk; it is never buffered whole
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_ATTACHMENT_SIZE:
+        raise HTTPException(status_code=413, detail="Attachment too large")
+    await check_attachment_entity(entity_type, entity_id, current_user)
+    
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    grid_in = get_attachments_bucket().open_upload_stream_with_id(
+        str(uuid.uuid4()),
+        filename,
+        metadata={
+            "entity_type": entity_type.value,
+            "entity_id": entity_id,
+            "content_type": content_type,
+            "uploaded_by": current_user.id
+        }
+    )
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MAX_ATTACHMENT_SIZE:
+                raise HTTPException(status_code=413, detail="Attachment too large")
+            digest.update(chunk)
+            await grid_in.write(chunk)
+        await grid_in.set("sha256", digest.hexdigest())
+        await grid_in.close()
+    except BaseException:
+        await grid_in.abort()
+        raise
+    
+    file_doc = await db["attachments.files"].find_one({"_id": grid_in._id})
+    return attachment_from_file(file_doc)
+
+@api_router.get("/{entity_type}/{entity_id}/attachments", response_model=List[Attachment])
+async def list_attachments(entity_type: AttachmentEntity, entity_id: str, current_user: Principal = Depends(get_read_principal)):
+    await check_attachment_entity(entity_type, entity_id, current_user)
+    files = await db["attachments.files"].find(
+        {"metadata.entity_type": entity_type.value, "metadata.entity_id": entity_id}
+    ).sort("uploadDate", 1).to_list(1000)
+    return [attachment_from_file(file_doc) for file_doc in files]
+
+@api_router.get("/attachments/{attachment_id}")
+async def download_attachment(
+    attachment_id: str,
+    range_header: Optional[str] = Header(None, alias="range"),
+    if_none_match: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+    current_user: Principal = Depends(get_read_principal)
+):
+    file_doc = await db["attachments.files"].find_one({"_id": attachment_id})
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    attachment = attachment_from_file(file_doc)
+    await check_attachment_entity(attachment.entity_type, attachment.entity_id, current_user)
+    
+    etag = f'"{attachment.sha256 or attachment.id}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": content_disposition(attachment.filename)
+    }
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    # A Range whose If-Range validator no longer matches gets the full, current file
+    # (If-Range needs a strong match, so unlike If-None-Match a W/ tag never matches)
+    byte_range = parse_range(range_header, attachment.length) if not if_range or if_range.strip() == etag else None
+    start, end = byte_range if byte_range else (0, attachment.length - 1)
+    status_code = 206 if byte_range else 200
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{attachment.length}"
+    headers["Content-Length"] = str(max(0, end - start + 1))
+    
+    async def stream_file():
+        try:
+            grid_out = await get_attachments_bucket().open_download_stream(attachment_id)
+        except NoFile:
+            return
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await grid_out.read(min(ATTACHMENT_READ_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    
+    return StreamingResponse(stream_file(), status_code=status_code, media_type=attachment.content_type, headers=headers)
+
+@api_router.delete("/attachments/{attachment_id}")
+async def delete_attachment(attachment_id: str, current_user: UserResponse = Depends(get_current_user)):
+    file_doc = await db["attachments.files"].find_one({"_id": attachment_id}, {"metadata": 1})
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    if current_user.role != UserRole.ADMIN and file_doc["metadata"].get("uploaded_by") != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    await get_attachments_bucket().delete(attachment_id)
+    return {"message": "Attachment deleted successfully"}
+
 # Maintenance Routes
 @api_router.post("/maintenance", response_model=MaintenanceRecord)
 async def create_maintenance_record(maintenance_data: MaintenanceRecordCreate, current_user: UserResponse = Depends(get_current_user)):
     # Check if equipment exists
-    equipment = await db.equipment.find_one({"id": maintenance_data.equipment_id})
+    equipment = await db.equipment.find_one({"id": maintenance_data.equipment_id, **LIVE_EQUIPMENT}, {"_id": 1})
     if not equipment:
         raise HTTPException(status_code=404, detail="Equipment not found")
     
@@ -346,31 +3122,242 @@ async def create_maintenance_record(maintenance_data: MaintenanceRecordCreate, c
     maintenance_obj = MaintenanceRecord(**maintenance_dict)
     
     await db.maintenance_records.insert_one(maintenance_obj.dict())
+    await maintenance_scheduler.schedule(maintenance_obj)
+    response_cache.invalidate(f"maintenance:{maintenance_obj.equipment_id}")
     return maintenance_obj
 
-@api_router.get("/maintenance/equipment/{equipment_id}", response_model=List[MaintenanceRecord])
-async def get_equipment_maintenance(equipment_id: str, current_user: UserResponse = Depends(get_current_user)):
-    maintenance_records = await db.maintenance_records.find({"equipment_id": equipment_id}).to_list(1000)
-    return [MaintenanceRecord(**record) for record in maintenance_records]
+@api_router.get("/maintenance/due", response_model=MaintenanceDuePage)
+async def get_due_maintenance(
+    within_days: int = Query(0, ge=0, le=366),
+    pending_only: bool = False,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: Principal = Depends(get_read_principal)
+):
+    # Equipment due now (or within the next within_days), most overdue first
+    query = {"due_at": {"$lte": datetime.utcnow() + timedelta(days=within_days)}}
+    if pending_only:
+        query["ticket_id"] = None
+    documents, next_cursor = await fetch_page(
+        db.maintenance_schedule, query, "due_at", limit, cursor, projection={"_id": 0}
+    )
+    return ORJSONResponse({
+        "items": [MaintenanceDue(**document).dict() for document in documents],
+        "next_cursor": next_cursor
+    })
 
-# Dashboard Stats (Admin only)
-@api_router.get("/stats")
-async def get_dashboard_stats(current_user: UserResponse = Depends(get_admin_user)):
-    total_equipment = await db.equipment.count_documents({})
-    active_equipment = await db.equipment.count_documents({"status": EquipmentStatus.ACTIVE})
-    open_tickets = await db.tickets.count_documents({"status": TicketStatus.OPEN})
-    total_users = await db.users.count_documents({})
+@api_router.get("/maintenance/equipment/{equipment_id}", response_model=Union[List[MaintenanceRecord], MaintenanceRecordPage])
+async def get_equipment_maintenance(
+    equipment_id: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    expand: Optional[str] = Query(None, description="Comma-separated: equipment, performed_by"),
+    current_user: Principal = Depends(get_read_principal)
+):
+    expansions = parse_expand(expand, {"equipment", "performed_by"})
+    # Expanded equipment fields go stale when any equipment changes
+    tags = [f"maintenance:{equipment_id}"] + (["equipment"] if "equipment" in expansions else [])
+    # Maintenance records have no created_at; performed_at is set when the record is created
+    return await cached_response(
+        request, "all", tags,
+        lambda: list_or_page(
+            MaintenanceRecord, db.maintenance_records, {"equipment_id": equipment_id}, "performed_at", limit, cursor, expansions
+        )
+    )
+
+# Report Routes (Admin only)
+@api_router.get("/reports/maintenance-cost")
+async def get_maintenance_cost_report(
+    group_by: str = Query("equipment", pattern="^(equipment|location|month)$"),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    refresh: bool = False,
+    current_user: UserResponse = Depends(get_admin_user)
+):
+    months = report_months(start, end)
+    rows, cached_months = await report_engine.monthly_rows("maintenance_cost", months, refresh)
+    
+    if group_by == "month":
+        merged = merge_rows(rows, "month", ["cost", "records"])
+        result = [{"month": month, **totals} for month, totals in sorted(merged.items())]
+    else:
+        merged = merge_rows(rows, "equipment_id", ["cost", "records"])
+        details = await equipment_details(merged, ["name", "serial_number", "location"])
+        if group_by == "equipment":
+            result = [
+                {
+                    "equipment_id": equipment_id,
+                    "name": details.get(equipment_id, {}).get("name"),
+                    "serial_number": details.get(equipment_id, {}).get("serial_number"),
+                    **totals
+                }
+                for equipment_id, totals in merged.items()
+            ]
+        else:
+            # Location is the equipment's current one; deleted equipment is reported as None
+            located = [
+                {"location": details.get(equipment_id, {}).get("location"), **totals}
+                for equipment_id, totals in merged.items()
+            ]
+            result = [{"location": location, **totals} for location, totals in merge_rows(located, "location", ["cost", "records"]).items()]
+        result.sort(key=lambda row: row["cost"], reverse=True)
     
+    for row in result:
+        row["cost"] = round(row["cost"], 2)
     return {
-        "total_equipment": total_equipment,
-        "active_equipment": active_equipment,
-        "open_tickets": open_tickets,
-        "total_users": total_users
+        "group_by": group_by,
+        "start": months[0].strftime("%Y-%m"),
+        "end": months[-1].strftime("%Y-%m"),
+        "total_cost": round(sum(row["cost"] for row in result), 2),
+        "rows": result,
+        "months_from_cache": cached_months
     }
 
+@api_router.get("/reports/ticket-mttr")
+async def get_ticket_mttr_report(
+    group_by: str = Query("month", pattern="^(month|priority)$"),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    refresh: bool = False,
+    current_user: UserResponse = Depends(get_admin_user)
+):
+    # Tickets count in the month they were resolved
+    months = report_months(start, end)
+    rows, cached_months = await report_engine.monthly_rows("ticket_resolution", months, refresh)
+    
+    def mttr_row(totals: dict) -> dict:
+        mean_hours = totals["seconds"] / totals["tickets"] / 3600 if totals["tickets"] else None
+        return {"tickets": totals["tickets"], "mean_hours_to_resolve": round(mean_hours, 2) if mean_hours is not None else None}
+    
+    merged = merge_rows(rows, group_by, ["seconds", "tickets"])
+    total_seconds = sum(totals["seconds"] for totals in merged.values())
+    total_tickets = sum(totals["tickets"] for totals in merged.values())
+    return {
+        "group_by": group_by,
+        "start": months[0].strftime("%Y-%m"),
+        "end": months[-1].strftime("%Y-%m"),
+        "overall": mttr_row({"seconds": total_seconds, "tickets": total_tickets}),
+        "rows": [{group_by: key, **mttr_row(totals)} for key, totals in sorted(merged.items())],
+        "months_from_cache": cached_months
+    }
+
+@api_router.get("/reports/failure-frequency")
+async def get_failure_frequency_report(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    refresh: bool = False,
+    current_user: UserResponse = Depends(get_admin_user)
+):
+    # Failures are tickets opened against a unit (scheduled preventive tickets excluded),
+    # normalised by how many units of the model are currently in the inventory
+    months = report_months(start, end)
+    rows, cached_months = await report_engine.monthly_rows("failures", months, refresh)
+    per_equipment = merge_rows(rows, "equipment_id", ["failures"])
+    details, units = await asyncio.gather(
+        equipment_details(per_equipment, ["manufacturer", "model"]),
+        db.equipment.aggregate([
+            {"$match": LIVE_EQUIPMENT},
+            {"$group": {"_id": {"manufacturer": "$manufacturer", "model": "$model"}, "units": {"$sum": 1}}}
+        ]).to_list(None)
+    )
+    
+    models = {(unit["_id"]["manufacturer"], unit["_id"]["model"]): {"failures": 0, "units": unit["units"]} for unit in units}
+    for equipment_id, totals in per_equipment.items():
+        item = details.get(equipment_id)
+        if item is None:
+            continue  # deleted since; its model is no longer in the inventory
+        models.setdefault((item["manufacturer"], item["model"]), {"failures": 0, "units": 0})["failures"] += totals["failures"]
+    
+    result = [
+        {
+            "manufacturer": manufacturer,
+            "model": model,
+            **counts,
+            "failures_per_unit": round(counts["failures"] / counts["units"], 3) if counts["units"] else None
+        }
+        for (manufacturer, model), counts in models.items()
+    ]
+    result.sort(key=lambda row: (row["failures_per_unit"] or 0, row["failures"]), reverse=True)
+    return {
+        "start": months[0].strftime("%Y-%m"),
+        "end": months[-1].strftime("%Y-%m"),
+        "rows": result,
+        "months_from_cache": cached_months
+    }
+
+@api_router.get("/admin/user-cache")
+async def get_user_cache_stats(current_user: UserResponse = Depends(get_admin_user)):
+    return user_cache.stats()
+
+@api_router.get("/admin/lookup-cache")
+async def get_lookup_cache_stats(current_user: UserResponse = Depends(get_admin_user)):
+    return equipment_lookup_cache.stats()
+
+@api_router.get("/admin/response-cache")
+async def get_response_cache_stats(current_user: UserResponse = Depends(get_admin_user)):
+    return response_cache.stats()
+
+# Dashboard Stats (Admin only)
+@api_router.get("/stats")
+async def get_dashboard_stats(request: Request, current_user: UserResponse = Depends(get_admin_user)):
+    if dashboard_counters.recounted_at is None:
+        await dashboard_counters.recount()
+    
+    # The counters are already in memory, so there is nothing to cache; the ETag covers the
+    # counts and recount time (not the snapshot age) so an unchanged dashboard gets a 304
+    etag = response_etag(json.dumps([dashboard_counters.counts, str(dashboard_counters.recounted_at)], sort_keys=True).encode('utf-8'))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(dashboard_counters.snapshot(), headers=headers)
+
+def route_template(scope) -> str:
+    # Label by route template (/api/equipment/{equipment_id}) so ids do not explode cardinality;
+    # the router stores the route it matched in the scope, so this is only known once it has run
+    return getattr(scope.get("route"), "path", "unmatched")
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request counts, latency and in-flight requests per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        status_code = 500
+        
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        HTTP_IN_FLIGHT.labels(method).inc()
+        scope_token = current_scope.set(scope)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_scope.reset(scope_token)
+            HTTP_IN_FLIGHT.labels(method).dec()
+            route = route_template(scope)
+            HTTP_REQUEST_SECONDS.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(metrics_registry()), media_type=CONTENT_TYPE_LATEST)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -386,6 +3373,88 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_client():
+    if client is None:
+        connect_db()
+
+@app.on_event("startup")
+async def ensure_indexes_on_startup():
+    if ENSURE_INDEXES_ON_STARTUP:
+        await ensure_indexes()
+
+@app.on_event("startup")
+async def start_dashboard_counters():
+    try:
+        await dashboard_counters.recount()
+    except Exception:
+        logger.exception("Initial dashboard recount failed; will retry on first request")
+    background_tasks.append(asyncio.create_task(
+        run_periodically(STATS_RECOUNT_INTERVAL, dashboard_counters.recount, "dashboard_recount")
+    ))
+
+@app.on_event("startup")
+async def start_maintenance_scheduler():
+    if not MAINTENANCE_SCHEDULER_ENABLED:
+        return
+    try:
+        await maintenance_scheduler.backfill()
+    except Exception:
+        logger.exception("Maintenance schedule backfill failed")
+    background_tasks.append(asyncio.create_task(
+        run_periodically(MAINTENANCE_SCHEDULER_INTERVAL, maintenance_scheduler.tick, "maintenance_scheduler")
+    ))
+
+@app.on_event("startup")
+async def start_equipment_archiver():
+    background_tasks.append(asyncio.create_task(
+        run_periodically(ARCHIVE_INTERVAL, equipment_archiver.run, "equipment_archiver")
+    ))
+
+@app.on_event("startup")
+async def start_change_log_flusher():
+    background_tasks.append(asyncio.create_task(
+        run_periodically(CHANGE_LOG_FLUSH_INTERVAL, change_log.flush, "change_log_flush")
+    ))
+
+@app.on_event("startup")
+async def start_change_stream_watcher():
+    if EVENT_SOURCE == 'change_stream':
+        background_tasks.append(asyncio.create_task(watch_change_stream()))
+    elif BACKEND_WORKERS > 1:
+        # Local events only reach sockets on the worker that made the write
+        logger.error(
+            f"EVENT_SOURCE=local with {BACKEND_WORKERS} workers: websocket clients miss changes made "
+            "by other workers. Set EVENT_SOURCE=change_stream or BACKEND_WORKERS=1"
+        )
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+@app.on_event("shutdown")
+async def flush_change_log():
+    await change_log.flush()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    if client is not None:
+        client.close()
+
+@app.on_event("shutdown")
+async def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+if __name__ == "__main__":
+    import sys
+    
+    # python server.py ensure-indexes
+    if sys.argv[1:] != ["ensure-indexes"]:
+        print("Usage: python server.py ensure-indexes")
+        sys.exit(2)
+    connect_db()
+    missing = asyncio.run(ensure_indexes())
+    sys.exit(1 if missing else 0)
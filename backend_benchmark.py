@@ -0,0 +1,479 @@
+import asyncio
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of latencies"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+    }
+
+class EndpointStats:
+    """Latency samples and error counts per endpoint template (e.g. 'GET /equipment/{id}')"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, name, elapsed, ok):
+        self.samples.setdefault(name, [])
+        self.errors.setdefault(name, 0)
+        if ok:
+            self.samples[name].append(elapsed)
+        else:
+            self.errors[name] += 1
+
+    def report(self, duration):
+        endpoints = {}
+        for name in sorted(self.samples):
+            endpoints[name] = {
+                **summarize(self.samples[name]),
+                "errors": self.errors[name],
+                "rps": round(len(self.samples[name]) / duration, 2),
+            }
+        all_samples = [sample for samples in self.samples.values() for sample in samples]
+        total = {
+            **summarize(all_samples),
+            "errors": sum(self.errors.values()),
+            "rps": round(len(all_samples) / duration, 2),
+        }
+        return endpoints, total
+
+class VirtualUser:
+    """Replays the MedicalEquipmentSystemTester scenarios (backend_test.py) in a loop"""
+
+    def __init__(self, number, client, base_url, credentials, stats):
+        self.number = number
+        self.client = client
+        self.base_url = base_url
+        self.username, self.password, self.is_admin = credentials
+        self.stats = stats
+        self.headers = {}
+
+    async def call(self, name, method, endpoint, expected_status=200, data=None):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, f"{self.base_url}/{endpoint}", json=data, headers=self.headers)
+        except httpx.HTTPError:
+            self.stats.record(name, time.perf_counter() - started, False)
+            return None
+        ok = response.status_code == expected_status
+        self.stats.record(name, time.perf_counter() - started, ok)
+        return response.json() if ok and response.content else None
+
+    async def login(self):
+        response = await self.call("POST /login", "POST", "login", data={"username": self.username, "password": self.password})
+        if response:
+            self.headers = {'Authorization': f'Bearer {response["access_token"]}'}
+        return response is not None
+
+    async def iteration(self, iteration):
+        await self.call("GET /me", "GET", "me")
+        equipment = await self.call("POST /equipment", "POST", "equipment", data={
+            "name": "Benchmark Ultrasound",
+            "model": "US-2000",
+            "manufacturer": "MedTech",
+            "serial_number": f"BENCH-{os.getpid()}-{self.number}-{iteration}-{time.time_ns()}",
+            "description": "Equipment created by backend_benchmark.py",
+            "location": f"Ward {self.number % 10}",
+            "status": "active",
+            "installation_date": datetime.utcnow().isoformat()
+        })
+        await self.call("GET /equipment", "GET", "equipment?limit=50")
+        if not equipment:
+            return
+        equipment_id = equipment["id"]
+
+        await self.call("GET /equipment/{id}", "GET", f"equipment/{equipment_id}")
+        await self.call("PUT /equipment/{id}", "PUT", f"equipment/{equipment_id}", data={"status": "maintenance"})
+
+        ticket = await self.call("POST /tickets", "POST", "tickets", data={
+            "equipment_id": equipment_id,
+            "title": "Benchmark Ticket",
+            "description": "Ticket created by backend_benchmark.py",
+            "priority": "high"
+        })
+        await self.call("GET /tickets", "GET", "tickets?limit=50")
+        if ticket:
+            await self.call("GET /tickets/{id}", "GET", f"tickets/{ticket['id']}")
+            await self.call("PUT /tickets/{id}", "PUT", f"tickets/{ticket['id']}", data={"status": "in_progress"})
+
+        await self.call("POST /maintenance", "POST", "maintenance", data={
+            "equipment_id": equipment_id,
+            "maintenance_type": "preventive",
+            "description": "Regular maintenance check",
+            "next_maintenance_date": datetime.utcnow().isoformat(),
+            "cost": 150.00,
+            "notes": "Everything looks good"
+        })
+        await self.call("GET /maintenance/equipment/{id}", "GET", f"maintenance/equipment/{equipment_id}")
+
+        if self.is_admin:
+            await self.call("GET /stats", "GET", "stats")
+            await self.call("DELETE /equipment/{id}", "DELETE", f"equipment/{equipment_id}")
+
+    async def run(self, deadline):
+        if not await self.login():
+            return
+        iteration = 0
+        while time.perf_counter() < deadline:
+            await self.iteration(iteration)
+            iteration += 1
+
+class LoadTest:
+    """Runs concurrent virtual users against the API and reports RPS and latency percentiles"""
+
+    def __init__(self, base_url, users, duration, accounts):
+        self.base_url = base_url.rstrip('/')
+        self.users = users
+        self.duration = duration
+        self.accounts = accounts
+        self.stats = EndpointStats()
+
+    async def seed_accounts(self, client):
+        # Registering is a no-op (400) for accounts that already exist
+        for username, password, is_admin in self.accounts:
+            await client.post(f"{self.base_url}/register", json={
+                "username": username,
+                "email": f"{username}@benchmark.local",
+                "password": password,
+                "role": "admin" if is_admin else "user"
+            })
+
+    async def run(self, seed=False):
+        limits = httpx.Limits(max_connections=self.users + 1)
+        async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+            if seed:
+                await self.seed_accounts(client)
+            print(f"\n🏃 Running {self.users} virtual users for {self.duration}s against {self.base_url}")
+            started = time.perf_counter()
+            deadline = started + self.duration
+            virtual_users = [
+                VirtualUser(number, client, self.base_url, self.accounts[number % len(self.accounts)], self.stats)
+                for number in range(self.users)
+            ]
+            await asyncio.gather(*(user.run(deadline) for user in virtual_users))
+            elapsed = time.perf_counter() - started
+
+        endpoints, total = self.stats.report(elapsed)
+        return {
+            "timestamp": datetime.utcnow().isoformat(),
+            "commit": git_commit(),
+            "config": {"base_url": self.base_url, "users": self.users, "duration": self.duration},
+            "endpoints": endpoints,
+            "total": total,
+        }
+
+class LoginStormBenchmark:
+    """Measures GET /equipment latency before and during a burst of logins"""
+
+    def __init__(self, base_url, username, password, probes, storm_users, duration):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.probes = probes
+        self.storm_users = storm_users
+        self.duration = duration
+        self.token = None
+        self.login_statuses = {}
+
+    async def login(self, client):
+        response = await client.post(
+            f"{self.base_url}/login",
+            json={"username": self.username, "password": self.password}
+        )
+        self.login_statuses[response.status_code] = self.login_statuses.get(response.status_code, 0) + 1
+        return response
+
+    async def probe_equipment(self, client, deadline, samples):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await client.get(f"{self.base_url}/equipment", headers=headers)
+            if response.status_code == 200:
+                samples.append(time.perf_counter() - started)
+
+    async def storm(self, client, deadline):
+        while time.perf_counter() < deadline:
+            await self.login(client)
+
+    async def run_phase(self, client, with_storm):
+        samples = []
+        deadline = time.perf_counter() + self.duration
+        tasks = [self.probe_equipment(client, deadline, samples) for _ in range(self.probes)]
+        if with_storm:
+            tasks += [self.storm(client, deadline) for _ in range(self.storm_users)]
+        await asyncio.gather(*tasks)
+        return summarize(samples)
+
+    async def run(self, seed=False):
+        limits = httpx.Limits(max_connections=self.probes + self.storm_users + 1)
+        async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+            if seed:
+                # Registering is a no-op (400) when the account already exists
+                await client.post(f"{self.base_url}/register", json={
+                    "username": self.username,
+                    "email": f"{self.username}@benchmark.local",
+                    "password": self.password,
+                    "role": "admin"
+                })
+            response = await self.login(client)
+            if response.status_code != 200:
+                print(f"❌ Login as {self.username} failed with status {response.status_code}")
+                return False
+            self.token = response.json()["access_token"]
+            self.login_statuses.clear()
+
+            print(f"\n📏 Baseline: {self.probes} probes on /equipment for {self.duration}s")
+            baseline = await self.run_phase(client, with_storm=False)
+            print(f"   {baseline}")
+
+            print(f"\n🌩️  Login storm: {self.storm_users} concurrent logins + {self.probes} probes for {self.duration}s")
+            storm = await self.run_phase(client, with_storm=True)
+            print(f"   {storm}")
+            print(f"   login responses by status: {self.login_statuses}")
+            if self.login_statuses.get(429):
+                print("   ⚠️  Logins were rate limited; raise LOGIN_IP_LIMIT on the server, or use --spawn/--mock-mongo")
+
+        if baseline["p99_ms"]:
+            print(f"\n📊 p99 ratio (storm/baseline): {storm['p99_ms'] / baseline['p99_ms']:.2f}x")
+        return True
+
+def serialization_benchmark(count, rounds):
+    """Compares the model-per-document list path with the projected orjson fast path"""
+    import uuid
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ.setdefault('DB_NAME', 'benchmark')
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    now = datetime.utcnow()
+    documents = [
+        {
+            "id": str(uuid.uuid4()),
+            "equipment_id": str(uuid.uuid4()),
+            "title": f"Ticket {number}",
+            "description": "Monitor does not power on after the last transport between wards",
+            "status": "open",
+            "priority": "high",
+            "created_by": str(uuid.uuid4()),
+            "assigned_to": None,
+            "created_at": now,
+            "updated_at": now,
+            "resolved_at": None,
+            "version": 0
+        }
+        for number in range(count)
+    ]
+    adapter = TypeAdapter(List[server.Ticket])
+    defaults = server.model_defaults(server.Ticket)
+
+    def model_path():
+        # [Ticket(**t) for t in ...], then response_model validation and JSONResponse rendering
+        items = [server.Ticket(**document) for document in documents]
+        validated = adapter.validate_python(items, from_attributes=True)
+        return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def fast_path():
+        return server.ORJSONResponse(server.fast_items([dict(document) for document in documents], defaults)).body
+
+    results = {}
+    for name, path in (("model", model_path), ("fast", fast_path)):
+        samples = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            path()
+            samples.append(time.perf_counter() - started)
+        results[name] = summarize(samples)
+        print(f"{name:<6} {count} tickets: {results[name]}")
+    if results["fast"]["p50_ms"]:
+        print(f"\n📊 p50 speedup: {results['model']['p50_ms'] / results['fast']['p50_ms']:.1f}x")
+    return True
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_report(result):
+    print(f"\n{'endpoint':<34}{'count':>8}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in list(result["endpoints"].items()) + [("TOTAL", result["total"])]:
+        print(f"{name:<34}{row['count']:>8}{row['errors']:>8}{row['rps']:>9}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+def compare_results(baseline_path, candidate_path, threshold):
+    """Prints p95 and RPS deltas per endpoint; returns False when any p95 regressed beyond threshold"""
+    baseline = json.loads(Path(baseline_path).read_text())
+    candidate = json.loads(Path(candidate_path).read_text())
+    print(f"\n📊 {baseline.get('commit')} → {candidate.get('commit')}")
+    print(f"{'endpoint':<34}{'p95 before':>12}{'p95 after':>12}{'change':>9}{'rps change':>12}")
+    regressed = False
+    for name, after in candidate["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if not before or not before["p95_ms"]:
+            continue
+        change = after["p95_ms"] / before["p95_ms"] - 1
+        rps_change = after["rps"] / before["rps"] - 1 if before["rps"] else 0.0
+        marker = " ❌" if change > threshold else ""
+        regressed = regressed or change > threshold
+        print(f"{name:<34}{before['p95_ms']:>12}{after['p95_ms']:>12}{change:>+9.1%}{rps_change:>+12.1%}{marker}")
+    return not regressed
+
+def serve_mock(port):
+    """Runs the API on an in-memory mongomock database (pip install mongomock-motor)"""
+    from mongomock_motor import AsyncMongoMockClient
+    import uvicorn
+
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ.setdefault('DB_NAME', 'benchmark')
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    server.connect_db(AsyncMongoMockClient())
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+def spawn_server(port, workers, mock_mongo):
+    if mock_mongo:
+        command = [sys.executable, __file__, "serve-mock", "--port", str(port)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1",
+                   "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    # Every virtual user logs in from this one address; keep the per-IP login limit out of the way
+    env = {**os.environ}
+    env.setdefault("LOGIN_IP_LIMIT", "1000000")
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with status {process.returncode}")
+        try:
+            if httpx.get(f"{base}/api/health", timeout=1.0).status_code == 200:
+                return process, f"{base}/api"
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Backend did not become ready")
+
+def run_login_storm(args):
+    process = None
+    base_url = args.base_url
+    if args.spawn or args.mock_mongo:
+        process, base_url = spawn_server(args.port, args.workers, args.mock_mongo)
+    try:
+        benchmark = LoginStormBenchmark(
+            base_url, args.username, args.password,
+            args.probes, args.storm_users, args.duration
+        )
+        return asyncio.run(benchmark.run(seed=args.seed or process is not None))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+def run_load(args):
+    accounts = [(args.username, args.password, True), (args.user_username, args.user_password, False)]
+    process = None
+    base_url = args.base_url
+    if args.spawn or args.mock_mongo:
+        process, base_url = spawn_server(args.port, args.workers, args.mock_mongo)
+    try:
+        load_test = LoadTest(base_url, args.users, args.duration, accounts)
+        result = asyncio.run(load_test.run(seed=args.seed or process is not None))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    print_report(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+        print(f"\n💾 Results written to {args.output}")
+    return result["total"]["count"] > 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Medical equipment API benchmarks")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    load = subcommands.add_parser("load", help="concurrent virtual users replaying the backend_test.py scenarios")
+    load.add_argument("--base-url", default="http://localhost:8001/api")
+    load.add_argument("--spawn", action="store_true", help="start a local uvicorn against MONGO_URL")
+    load.add_argument("--mock-mongo", action="store_true", help="start a local uvicorn on an in-memory mongomock database")
+    load.add_argument("--port", type=int, default=8101)
+    load.add_argument("--workers", type=int, default=1)
+    load.add_argument("--seed", action="store_true", help="register the benchmark accounts first")
+    load.add_argument("--users", type=int, default=20)
+    load.add_argument("--duration", type=float, default=30.0)
+    load.add_argument("--username", default="admin")
+    load.add_argument("--password", default="admin123")
+    load.add_argument("--user-username", default="user")
+    load.add_argument("--user-password", default="user123")
+    load.add_argument("--output", help="write results as JSON to this path")
+
+    storm = subcommands.add_parser(
+        "login-storm", help="/equipment latency before and during a login storm",
+        description="All storm logins come from one address, so a server started without --spawn or "
+                    "--mock-mongo needs LOGIN_IP_LIMIT raised (e.g. 1000000) or most logins get 429."
+    )
+    storm.add_argument("--base-url", default="http://localhost:8001/api")
+    storm.add_argument("--spawn", action="store_true", help="start a local uvicorn against MONGO_URL with LOGIN_IP_LIMIT raised")
+    storm.add_argument("--mock-mongo", action="store_true", help="start a local uvicorn on an in-memory mongomock database")
+    storm.add_argument("--port", type=int, default=8101)
+    storm.add_argument("--workers", type=int, default=1)
+    storm.add_argument("--seed", action="store_true", help="register the benchmark account first")
+    storm.add_argument("--username", default="admin")
+    storm.add_argument("--password", default="admin123")
+    storm.add_argument("--probes", type=int, default=4)
+    storm.add_argument("--storm-users", type=int, default=50)
+    storm.add_argument("--duration", type=float, default=10.0)
+
+    compare = subcommands.add_parser("compare", help="compare two load result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=0.10, help="allowed p95 increase (0.10 = 10%%)")
+
+    serialization = subcommands.add_parser("serialization", help="micro-benchmark of list response serialization")
+    serialization.add_argument("--count", type=int, default=1000)
+    serialization.add_argument("--rounds", type=int, default=50)
+
+    serve = subcommands.add_parser("serve-mock", help=argparse.SUPPRESS)
+    serve.add_argument("--port", type=int, default=8101)
+
+    args = parser.parse_args()
+    if args.command == "load":
+        success = run_load(args)
+    elif args.command == "login-storm":
+        success = run_login_storm(args)
+    elif args.command == "compare":
+        success = compare_results(args.baseline, args.candidate, args.threshold)
+    elif args.command == "serialization":
+        success = serialization_benchmark(args.count, args.rounds)
+    else:
+        serve_mock(args.port)
+        success = True
+    sys.exit(0 if success else 1)
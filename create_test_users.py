@@ -74,7 +74,8 @@ async def create_test_users():
             "installation_date": datetime(2024, 1, 15),
             "created_by": test_users[0]["id"],
             "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
+            "updated_at": datetime.utcnow(),
+            "deleted_at": None
         },
         {
             "id": str(uuid.uuid4()),
@@ -88,7 +89,8 @@ async def create_test_users():
             "installation_date": datetime(2024, 2, 10),
             "created_by": test_users[0]["id"],
             "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
+            "updated_at": datetime.utcnow(),
+            "deleted_at": None
         },
         {
             "id": str(uuid.uuid4()),
@@ -102,11 +104,16 @@ async def create_test_users():
             "installation_date": datetime(2023, 12, 5),
             "created_by": test_users[0]["id"],
             "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
+            "updated_at": datetime.utcnow(),
+            "deleted_at": None
         }
     ]
     
     await db.equipment.delete_many({})
+    # Lowercased keys behind the backend's prefix search
+    for item in sample_equipment:
+        item["name_lower"] = item["name"].lower()
+        item["serial_lower"] = item["serial_number"].lower()
     await db.equipment.insert_many(sample_equipment)
     
     # Create sample tickets
@@ -4,18 +4,45 @@ set -e
 # Start the FastAPI backend
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
-echo "Starting FastAPI backend"
+# Local change events are per process, so only fan out over workers when they come from a change stream
+if [ -z "$BACKEND_WORKERS" ]; then
+    if [ "$EVENT_SOURCE" = "change_stream" ]; then
+        BACKEND_WORKERS=$(nproc)
+    else
+        BACKEND_WORKERS=1
+    fi
+fi
+export BACKEND_WORKERS
+BACKEND_READY_TIMEOUT=${BACKEND_READY_TIMEOUT:-120}
+
+# Per-worker metrics are merged at scrape time from this directory
+if [ "$BACKEND_WORKERS" -gt 1 ]; then
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-multiproc}
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+echo "Starting FastAPI backend with $BACKEND_WORKERS workers"
 # Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
+uvicorn server:app --host 0.0.0.0 --port 8001 --workers "$BACKEND_WORKERS" &
 BACKEND_PID=$!
 
-echo "Waiting for backend to start..."
-sleep 30
-
-if ! kill -0 $BACKEND_PID 2>/dev/null; then
-    echo "Backend failed to start at initialization, exiting"
-    exit 1
-fi
+echo "Waiting for backend to become ready..."
+WAITED=0
+until wget -q -T 2 -O /dev/null http://127.0.0.1:8001/api/health 2>/dev/null; do
+    if ! kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "Backend failed to start at initialization, exiting"
+        exit 1
+    fi
+    if [ "$WAITED" -ge $((BACKEND_READY_TIMEOUT * 2)) ]; then
+        echo "Backend not ready after ${BACKEND_READY_TIMEOUT}s, exiting"
+        kill $BACKEND_PID
+        exit 1
+    fi
+    sleep 0.5
+    WAITED=$((WAITED + 1))
+done
+echo "Backend ready"
 
 # Start Nginx
 nginx -g 'daemon off;' &
@@ -340,31 +340,54 @@ function Dashboard({ user }) {
 }
 
 // Equipment Management Component
+const EQUIPMENT_PAGE_SIZE = 60;
+
 function EquipmentManagement({ user }) {
   const [equipment, setEquipment] = useState([]);
+  const [total, setTotal] = useState(0);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [showAddForm, setShowAddForm] = useState(false);
   const [editingEquipment, setEditingEquipment] = useState(null);
   const [searchTerm, setSearchTerm] = useState('');
 
   useEffect(() => {
-    loadEquipment();
-  }, []);
+    const timeout = setTimeout(() => {
+      loadEquipment();
+    }, 300);
+    return () => clearTimeout(timeout);
+  }, [searchTerm]);
+
+  const fetchPage = (offset) => {
+    const params = { limit: EQUIPMENT_PAGE_SIZE, offset };
+    if (searchTerm.trim()) {
+      // Keep trailing whitespace: it tells the backend the last word is complete
+      params.q = searchTerm.trimStart();
+    }
+    return api.get('/equipment/search', { params });
+  };
 
   const loadEquipment = async () => {
     try {
-      const response = await api.get('/equipment');
-      setEquipment(response.data);
+      const response = await fetchPage(0);
+      setEquipment(response.data.items);
+      setTotal(response.data.total);
     } catch (error) {
       console.error('Error loading equipment:', error);
     }
   };
 
-  const filteredEquipment = equipment.filter(eq =>
-    eq.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    eq.manufacturer.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    eq.model.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    eq.location.toLowerCase().includes(searchTerm.toLowerCase())
-  );
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await fetchPage(equipment.length);
+      setEquipment([...equipment, ...response.data.items]);
+      setTotal(response.data.total);
+    } catch (error) {
+      console.error('Error loading equipment:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   return (
     <div className="space-y-6">
@@ -390,7 +413,7 @@ function EquipmentManagement({ user }) {
         </div>
 
         <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
-          {filteredEquipment.map((eq) => (
+          {equipment.map((eq) => (
             <EquipmentCard 
               key={eq.id} 
               equipment={eq} 
@@ -401,11 +424,23 @@ function EquipmentManagement({ user }) {
           ))}
         </div>
 
-        {filteredEquipment.length === 0 && (
+        {equipment.length === 0 && (
           <div className="text-center py-8">
             <p className="text-gray-500">Nenhum equipamento encontrado</p>
           </div>
         )}
+
+        {equipment.length < total && (
+          <div className="text-center mt-6">
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="px-4 py-2 border border-gray-300 rounded-lg text-gray-700 hover:bg-gray-50 disabled:opacity-50"
+            >
+              {loadingMore ? 'Carregando...' : `Carregar mais (${equipment.length} de ${total})`}
+            </button>
+          </div>
+        )}
       </div>
 
       {showAddForm && (
@@ -439,7 +474,7 @@ function TicketManagement({ user }) {
 
   const loadTickets = async () => {
     try {
-      const response = await api.get('/tickets');
+      const response = await api.get('/tickets', { params: { expand: 'equipment' } });
       setTickets(response.data);
     } catch (error) {
       console.error('Error loading tickets:', error);
@@ -673,7 +708,7 @@ function EquipmentCard({ equipment, onEdit, onRefresh, userRole }) {
 function TicketCard({ ticket, equipment, onRefresh, userRole }) {
   const [isExpanded, setIsExpanded] = useState(false);
   
-  const equipmentInfo = equipment.find(eq => eq.id === ticket.equipment_id);
+  const equipmentInfo = ticket.expanded?.equipment || equipment.find(eq => eq.id === ticket.equipment_id);
 
   const handleStatusUpdate = async (newStatus) => {
     try {
@@ -0,0 +1,64 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import content_disposition, parse_range  # noqa: E402
+
+
+@pytest.mark.parametrize("range_header", [None, "", "items=0-10", "bytes=0-1,5-6", "bytes=a-b", "bytes=-"])
+def test_unusable_range_sends_the_whole_file(range_header):
+    assert parse_range(range_header, 100) is None
+
+
+@pytest.mark.parametrize("range_header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-", (10, 99)),
+    ("bytes=90-200", (90, 99)),
+    ("bytes=99-99", (99, 99)),
+    ("bytes= 5-6 ", (5, 6)),
+])
+def test_byte_ranges(range_header, expected):
+    assert parse_range(range_header, 100) == expected
+
+
+@pytest.mark.parametrize("range_header, expected", [
+    ("bytes=-10", (90, 99)),
+    ("bytes=-1", (99, 99)),
+    # A suffix longer than the file selects all of it
+    ("bytes=-500", (0, 99)),
+])
+def test_suffix_ranges(range_header, expected):
+    assert parse_range(range_header, 100) == expected
+
+
+@pytest.mark.parametrize("range_header, length", [
+    ("bytes=100-", 100),
+    ("bytes=150-200", 100),
+    ("bytes=10-5", 100),
+    ("bytes=-0", 100),
+    ("bytes=0-", 0),
+    ("bytes=-5", 0),
+])
+def test_unsatisfiable_ranges_are_416(range_header, length):
+    with pytest.raises(HTTPException) as error:
+        parse_range(range_header, length)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == f"bytes */{length}"
+
+
+def test_ascii_filename_is_kept():
+    assert content_disposition("manual.pdf") == "attachment; filename=\"manual.pdf\"; filename*=UTF-8''manual.pdf"
+
+
+def test_non_ascii_and_quotes_fall_back_to_underscores():
+    header = content_disposition('Schéma "v2".pdf')
+    assert header.startswith('attachment; filename="Sch_ma _v2_.pdf"; ')
+    assert header.endswith("filename*=UTF-8''Sch%C3%A9ma%20%22v2%22.pdf")
+    header.encode("latin-1")
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from server import ChangeLog, db  # noqa: E402
+
+T0 = datetime(2024, 5, 1, 12)
+
+
+@pytest.fixture(autouse=True)
+def mock_db():
+    server.connect_db(AsyncMongoMockClient())
+
+
+def at(minutes):
+    return T0 + timedelta(minutes=minutes)
+
+
+def entry(seq, action, changes=None, minutes=None, entity_type="equipment", entity_id="e1"):
+    return {
+        "entity_type": entity_type, "entity_id": entity_id, "seq": seq, "action": action,
+        "changes": changes, "actor": "admin", "at": at(seq if minutes is None else minutes)
+    }
+
+
+def state_at(when, entity_type="equipment", entity_id="e1"):
+    return asyncio.run(ChangeLog(100, 50, 1000).state_at(entity_type, entity_id, when))
+
+
+def test_state_replays_entries_up_to_the_time():
+    asyncio.run(db.change_log.insert_many([
+        entry(0, "created", {"id": "e1", "name": "Pump", "location": "Hall"}),
+        entry(1, "updated", {"location": "Lab"}),
+        entry(2, "updated", {"name": "Big pump"}),
+    ]))
+    assert state_at(at(1)) == (1, {"id": "e1", "name": "Pump", "location": "Lab", "updated_at": at(1), "version": 1})
+    seq, state = state_at(at(10))
+    assert seq == 2 and state["name"] == "Big pump" and state["version"] == 2
+
+
+def test_before_creation_there_is_no_state():
+    asyncio.run(db.change_log.insert_one(entry(0, "created", {"id": "e1"}, minutes=5)))
+    assert state_at(at(4)) == (None, None)
+
+
+def test_deleted_entity_has_no_state():
+    asyncio.run(db.change_log.insert_many([
+        entry(0, "created", {"id": "e1", "name": "Pump"}),
+        entry(1, "deleted"),
+    ]))
+    assert state_at(at(10)) == (1, None)
+    assert state_at(at(0))[1]["name"] == "Pump"
+
+
+def test_state_starts_from_the_nearest_snapshot():
+    # Entries before the snapshot were pruned; only the snapshot can supply them
+    asyncio.run(db.change_snapshots.insert_many([
+        {"entity_type": "equipment", "entity_id": "e1", "seq": 2, "state": {"id": "e1", "name": "Pump", "location": "Hall"}, "at": at(2)},
+        {"entity_type": "equipment", "entity_id": "e1", "seq": 4, "state": {"id": "e1", "name": "Pump", "location": "Yard"}, "at": at(4)},
+    ]))
+    asyncio.run(db.change_log.insert_many([
+        entry(3, "updated", {"location": "Lab"}),
+        entry(4, "updated", {"location": "Yard"}),
+        entry(5, "updated", {"name": "Big pump"}),
+    ]))
+    assert state_at(at(3))[1] == {"id": "e1", "name": "Pump", "location": "Lab", "updated_at": at(3), "version": 3}
+    assert state_at(at(5))[1] == {"id": "e1", "name": "Big pump", "location": "Yard", "updated_at": at(5), "version": 5}
+
+
+def test_state_is_scoped_to_the_entity_type():
+    asyncio.run(db.change_log.insert_many([
+        entry(0, "created", {"id": "x", "name": "Pump"}, entity_id="x"),
+        entry(0, "created", {"id": "x", "title": "Leak"}, entity_type="tickets", entity_id="x"),
+        entry(1, "updated", {"title": "Big leak"}, entity_type="tickets", entity_id="x"),
+    ]))
+    assert state_at(at(10), entity_id="x") == (0, {"id": "x", "name": "Pump", "version": 0})
+    assert state_at(at(10), "tickets", "x")[1]["title"] == "Big leak"
+
+
+def test_state_includes_buffered_entries():
+    log = ChangeLog(100, 50, 1000)
+    log.record("equipment", "e1", 0, "created", {"_id": "oid", "id": "e1", "name": "Pump", "updated_at": T0})
+    seq, state = asyncio.run(log.state_at("equipment", "e1", datetime.utcnow() + timedelta(seconds=1)))
+    assert seq == 0 and state == {"id": "e1", "name": "Pump", "version": 0}
+
+
+def test_flush_writes_a_snapshot_every_snapshot_every_versions():
+    log = ChangeLog(100, 2, 1000)
+    for seq in range(5):
+        log.record("equipment", "e1", seq, "updated", {"seq": seq}, state={"id": "e1", "seq": seq})
+    asyncio.run(log.flush())
+    assert asyncio.run(db.change_log.count_documents({})) == 5
+    snapshots = asyncio.run(db.change_snapshots.find({}, {"_id": 0}).to_list(None))
+    assert sorted(s["seq"] for s in snapshots) == [2, 4]
+
+
+def test_baseline_is_written_only_for_entities_without_history():
+    asyncio.run(db.change_log.insert_one(entry(0, "created", {"id": "logged"}, entity_id="logged")))
+    log = ChangeLog(100, 50, 1000)
+    previous = {"id": "x", "name": "Pump", "updated_at": T0}
+    log.record("equipment", "logged", 1, "updated", {"name": "A"}, previous=previous)
+    log.record("equipment", "legacy", 4, "updated", {"name": "B"}, previous=previous)
+    asyncio.run(log.flush())
+    baselines = asyncio.run(db.change_snapshots.find({}, {"_id": 0}).to_list(None))
+    assert [(b["entity_id"], b["seq"], b["at"]) for b in baselines] == [("legacy", 3, T0)]
+
+
+def test_failed_writes_are_retried_and_the_buffer_stays_bounded(monkeypatch):
+    log = ChangeLog(100, 50, 3)
+
+    async def unreachable(collection, documents):
+        return documents
+
+    monkeypatch.setattr(log, "write", unreachable)
+    for seq in range(5):
+        log.record("equipment", "e1", seq, "updated", {"seq": seq})
+    asyncio.run(log.flush())
+    assert [e["seq"] for e in log.events] == [2, 3, 4]
+    assert log.dropped == 2
+
+    monkeypatch.undo()
+    asyncio.run(log.flush())
+    assert log.events == []
+    assert asyncio.run(db.change_log.count_documents({})) == 3
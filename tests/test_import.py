@@ -0,0 +1,113 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import iter_import_rows, iter_request_lines  # noqa: E402
+
+
+class FakeRequest:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+async def iter_lines(text):
+    for line in text.splitlines(keepends=True):
+        yield line
+
+
+def import_rows(text, import_format):
+    async def collect():
+        return [row async for row in iter_import_rows(iter_lines(text), import_format)]
+    return asyncio.run(collect())
+
+
+def request_lines(chunks):
+    async def collect():
+        return [line async for line in iter_request_lines(FakeRequest(chunks))]
+    return asyncio.run(collect())
+
+
+def test_request_lines_rejoin_chunk_boundaries():
+    body = "name,serial\nPump,é1\nValve,2".encode("utf-8")
+    # Split inside the two-byte "é" and inside a line
+    chunks = [body[:15], body[15:18], body[18:]]
+    assert request_lines(chunks) == ["name,serial\n", "Pump,é1\n", "Valve,2"]
+
+
+def test_request_lines_strip_the_bom():
+    assert request_lines([b"\xef\xbb\xbfname\n"]) == ["name\n"]
+
+
+def test_csv_rows_use_the_header_and_drop_empty_cells():
+    rows = import_rows("name,serial_number,location\nPump,SN-1,\nValve,SN-2,Hall\n", "csv")
+    assert rows == [
+        (2, {"name": "Pump", "serial_number": "SN-1"}),
+        (3, {"name": "Valve", "serial_number": "SN-2", "location": "Hall"}),
+    ]
+
+
+def test_csv_header_is_trimmed():
+    rows = import_rows(" name , serial_number\nPump,SN-1\n", "csv")
+    assert rows == [(2, {"name": "Pump", "serial_number": "SN-1"})]
+
+
+def test_csv_line_numbers_count_blank_lines():
+    rows = import_rows("\nname,serial_number\n\nPump,SN-1\n,\nValve,SN-2\n", "csv")
+    assert [line for line, _ in rows] == [4, 6]
+
+
+def test_csv_quoted_newline_keeps_the_record_start_line():
+    rows = import_rows('name,description\n"Pump","first line\nsecond ""quoted"" line"\nValve,plain\n', "csv")
+    assert rows == [
+        (2, {"name": "Pump", "description": 'first line\nsecond "quoted" line'}),
+        (4, {"name": "Valve", "description": "plain"}),
+    ]
+
+
+def test_csv_column_count_mismatch_is_a_row_error():
+    rows = import_rows("name,serial_number\nPump\nValve,SN-2,extra\nGauge,SN-3\n", "csv")
+    assert rows == [
+        (2, "Expected 2 columns, got 1"),
+        (3, "Expected 2 columns, got 3"),
+        (4, {"name": "Gauge", "serial_number": "SN-3"}),
+    ]
+
+
+def test_csv_unterminated_quote_is_reported_at_its_start():
+    rows = import_rows('name,serial_number\nPump,SN-1\n"Valve,SN-2\nGauge,SN-3\n', "csv")
+    assert rows == [
+        (2, {"name": "Pump", "serial_number": "SN-1"}),
+        (3, "Unterminated quoted field"),
+    ]
+
+
+def test_csv_header_only_yields_nothing():
+    assert import_rows("name,serial_number\n", "csv") == []
+
+
+def test_ndjson_rows_count_every_line():
+    rows = import_rows('{"name": "Pump"}\n\n{"name": "Valve"}\n', "ndjson")
+    assert rows == [(1, {"name": "Pump"}), (3, {"name": "Valve"})]
+
+
+@pytest.mark.parametrize("line, error", [
+    ("{not json}", "Invalid JSON"),
+    ('["Pump"]', "Expected a JSON object"),
+    ("42", "Expected a JSON object"),
+])
+def test_ndjson_bad_lines_are_row_errors(line, error):
+    rows = import_rows(f'{{"name": "Pump"}}\n{line}\n{{"name": "Valve"}}\n', "ndjson")
+    assert rows[0] == (1, {"name": "Pump"})
+    assert rows[1][0] == 2 and rows[1][1].startswith(error)
+    assert rows[2] == (3, {"name": "Valve"})
@@ -0,0 +1,71 @@
+import asyncio
+import base64
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import decode_cursor, encode_cursor, fetch_page  # noqa: E402
+
+
+def test_cursor_round_trips_sort_value_and_id():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    cursor = encode_cursor({"id": "abc", "created_at": created_at}, "created_at")
+    assert decode_cursor(cursor) == (created_at, "abc")
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor({"id": "?/+&", "created_at": datetime(2024, 5, 1)}, "created_at")
+    assert all(c.isalnum() or c in "-_=" for c in cursor)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(b'["a", "b"]').decode(),
+    base64.urlsafe_b64encode(b'{"id": "abc"}').decode(),
+    base64.urlsafe_b64encode(b'{"t": "yesterday", "id": "abc"}').decode(),
+    base64.urlsafe_b64encode(b'{"t": 5, "id": "abc"}').decode(),
+])
+def test_invalid_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_fetch_page_walks_every_document_once():
+    collection = AsyncMongoMockClient()["test"]["items"]
+    start = datetime(2024, 1, 1)
+    # Pairs of documents share a timestamp, so the id tie-breaker decides their order
+    documents = [{"id": f"{i:02d}", "created_at": start + timedelta(minutes=i // 2)} for i in range(7)]
+    asyncio.run(collection.insert_many([dict(d) for d in reversed(documents)]))
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = asyncio.run(fetch_page(collection, {}, "created_at", 3, cursor, {"_id": 0}))
+        seen.extend(d["id"] for d in page)
+        if cursor is None:
+            break
+    assert seen == [d["id"] for d in documents]
+
+
+def test_fetch_page_keeps_the_query_filter():
+    collection = AsyncMongoMockClient()["test"]["items"]
+    start = datetime(2024, 1, 1)
+    asyncio.run(collection.insert_many([
+        {"id": f"{i:02d}", "created_at": start + timedelta(minutes=i), "even": i % 2 == 0} for i in range(6)
+    ]))
+
+    page, cursor = asyncio.run(fetch_page(collection, {"even": True}, "created_at", 2, None, {"_id": 0}))
+    assert [d["id"] for d in page] == ["00", "02"]
+    page, cursor = asyncio.run(fetch_page(collection, {"even": True}, "created_at", 2, cursor, {"_id": 0}))
+    assert [d["id"] for d in page] == ["04"]
+    assert cursor is None
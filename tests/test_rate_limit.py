@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import MemoryRateLimitStore, SlidingWindowLimiter  # noqa: E402
+
+
+def make_limiter(limit=10, window=60.0, elapsed=0.5, window_number=100, shards=1, max_keys=100):
+    limiter = SlidingWindowLimiter("test", limit, window, MemoryRateLimitStore(shards, max_keys))
+    limiter.position = lambda: (window_number, elapsed)
+    return limiter
+
+
+def hit_until_limited(limiter, key="client"):
+    """Returns how many hits were allowed, and the 429 that stopped them."""
+    allowed = 0
+    while True:
+        try:
+            asyncio.run(limiter.check(key))
+        except HTTPException as e:
+            return allowed, e
+        allowed += 1
+
+
+def test_allows_limit_hits_in_an_empty_window():
+    allowed, error = hit_until_limited(make_limiter(limit=10))
+    assert allowed == 10
+    assert error.status_code == 429
+
+
+def test_previous_window_counts_by_remaining_overlap():
+    limiter = make_limiter(limit=10, elapsed=0.5, window_number=100)
+    for _ in range(10):
+        asyncio.run(limiter.store.add("test:client", 99, 120))
+    # Half of the previous window's 10 hits still overlap, leaving room for 5
+    allowed, _ = hit_until_limited(limiter)
+    assert allowed == 5
+
+
+def test_previous_window_fades_as_the_window_advances():
+    limiter = make_limiter(limit=10, elapsed=0.9, window_number=100)
+    for _ in range(10):
+        asyncio.run(limiter.store.add("test:client", 99, 120))
+    allowed, _ = hit_until_limited(limiter)
+    assert allowed == 9
+
+
+def test_retry_after_waits_for_the_previous_window_to_fade():
+    limiter = make_limiter(limit=10, window=60.0)
+    # 5 + 10 * (1 - t) falls to 10 at t = 0.5, a quarter window (15s) after 0.25
+    assert limiter.retry_after(current=5, previous=10, elapsed=0.25) == 15
+
+
+def test_retry_after_over_limit_in_current_window():
+    limiter = make_limiter(limit=10, window=60.0)
+    # 12 hits only fall under 10 once they are 1/6 into the next window: (1 - 0.5 + 1/6) * 60
+    assert limiter.retry_after(current=12, previous=0, elapsed=0.5) == 40
+
+
+def test_retry_after_is_at_least_one_second():
+    limiter = make_limiter(limit=10, window=60.0)
+    assert limiter.retry_after(current=5, previous=10, elapsed=0.5) == 1
+
+
+def test_429_carries_retry_after_header():
+    limiter = make_limiter(limit=2, window=60.0, elapsed=0.5)
+    _, error = hit_until_limited(limiter)
+    # 3 hits need 1/3 of the next window to fall under 2: (1 - 0.5 + 1/3) * 60 = 50
+    assert error.headers["Retry-After"] == "50"
+
+
+def test_check_without_hit_does_not_count():
+    limiter = make_limiter(limit=2)
+    for _ in range(5):
+        asyncio.run(limiter.check("client", hit=False))
+    assert asyncio.run(limiter.store.get("test:client", 100)) == (0, 0)
+
+
+def test_check_without_hit_rejects_at_the_limit():
+    limiter = make_limiter(limit=2)
+    asyncio.run(limiter.hit("client"))
+    asyncio.run(limiter.hit("client"))
+    with pytest.raises(HTTPException):
+        asyncio.run(limiter.check("client", hit=False))
+
+
+def test_reset_clears_the_key():
+    limiter = make_limiter(limit=2)
+    hit_until_limited(limiter)
+    asyncio.run(limiter.reset("client"))
+    asyncio.run(limiter.check("client"))
+
+
+def test_memory_store_rolls_windows_forward():
+    store = MemoryRateLimitStore(1, 100)
+    asyncio.run(store.add("key", 5, 120))
+    asyncio.run(store.add("key", 5, 120))
+    assert asyncio.run(store.get("key", 5)) == (2, 0)
+    assert asyncio.run(store.get("key", 6)) == (0, 2)
+    assert asyncio.run(store.get("key", 7)) == (0, 0)
+
+
+def test_memory_store_evicts_least_recently_used_keys():
+    store = MemoryRateLimitStore(1, 2)
+    for key in ("a", "b", "a", "c"):
+        asyncio.run(store.add(key, 1, 120))
+    assert asyncio.run(store.get("a", 1)) == (2, 0)
+    assert asyncio.run(store.get("b", 1)) == (0, 0)
+    assert asyncio.run(store.get("c", 1)) == (1, 0)
@@ -0,0 +1,102 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import ResponseCache, etag_matches  # noqa: E402
+
+
+def store(cache, key, body=b"{}", tags=("equipment",)):
+    tags = list(tags)
+    return cache.put(key, body, {}, tags, cache.generation(tags))
+
+
+def test_put_then_get_returns_the_entry():
+    cache = ResponseCache(1024, 60)
+    entry = store(cache, "a", b'{"x": 1}')
+    assert cache.get("a") is entry
+    assert entry["etag"].startswith('"')
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_response_built_across_an_invalidation_is_not_stored():
+    cache = ResponseCache(1024, 60)
+    generation = cache.generation(["equipment", "equipment:1"])
+    # A write lands while the response is being built
+    cache.invalidate("equipment:1")
+    entry = cache.put("a", b"{}", {}, ["equipment", "equipment:1"], generation)
+    assert entry["body"] == b"{}"
+    assert cache.get("a") is None
+
+
+def test_invalidation_of_an_unrelated_tag_keeps_the_put():
+    cache = ResponseCache(1024, 60)
+    generation = cache.generation(["equipment"])
+    cache.invalidate("tickets")
+    cache.put("a", b"{}", {}, ["equipment"], generation)
+    assert cache.get("a") is not None
+
+
+def test_invalidate_removes_every_entry_with_the_tag():
+    cache = ResponseCache(1024, 60)
+    store(cache, "list", tags=["equipment"])
+    store(cache, "one", tags=["equipment", "equipment:1"])
+    store(cache, "two", tags=["equipment", "equipment:2"])
+    cache.invalidate("equipment:1")
+    assert cache.get("one") is None
+    assert cache.get("two") is not None
+    cache.invalidate("equipment")
+    assert cache.entries == {}
+    assert cache.tag_keys == {}
+    assert cache.size == 0
+
+
+def test_least_recently_used_entries_are_evicted_first():
+    cache = ResponseCache(10, 60)
+    store(cache, "a", b"aaaa")
+    store(cache, "b", b"bbbb")
+    cache.get("a")
+    store(cache, "c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.size == 8
+    assert cache.evictions == 1
+
+
+def test_oversized_body_is_served_but_not_stored():
+    cache = ResponseCache(4, 60)
+    entry = store(cache, "a", b"too large")
+    assert entry["body"] == b"too large"
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+def test_replacing_a_key_keeps_the_size_accurate():
+    cache = ResponseCache(1024, 60)
+    store(cache, "a", b"aaaa")
+    store(cache, "a", b"aa")
+    assert cache.size == 2
+
+
+def test_expired_entry_is_a_miss():
+    cache = ResponseCache(1024, -1)
+    store(cache, "a")
+    assert cache.get("a") is None
+    assert cache.entries == {}
+
+
+@pytest.mark.parametrize("if_none_match, matches", [
+    (None, False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", "abc"', True),
+    ("*", True),
+    ('"xyz"', False),
+])
+def test_etag_matches_uses_weak_comparison(if_none_match, matches):
+    assert etag_matches(if_none_match, '"abc"') is matches
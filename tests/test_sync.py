@@ -0,0 +1,123 @@
+import asyncio
+import base64
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import orjson
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from server import Principal, UserRole, db, decode_sync_token, encode_sync_token, sync_changes  # noqa: E402
+
+ADMIN = Principal(id="admin", role=UserRole.ADMIN)
+USER = Principal(id="user", role=UserRole.USER)
+
+
+@pytest.fixture(autouse=True)
+def mock_db():
+    server.connect_db(AsyncMongoMockClient())
+
+
+def equipment(equipment_id, updated_at, **fields):
+    return {
+        "id": equipment_id, "name": equipment_id, "model": "M", "manufacturer": "Acme",
+        "serial_number": f"SN-{equipment_id}", "location": "Hall", "created_by": "admin",
+        "created_at": updated_at, "updated_at": updated_at, "deleted_at": None, **fields
+    }
+
+
+def sync(since=None, principal=ADMIN):
+    response = asyncio.run(sync_changes(since=since, current_user=principal))
+    return orjson.loads(response.body)
+
+
+def test_token_round_trips_a_batch_in_progress():
+    since, until = datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 13)
+    token = encode_sync_token({"since": since, "until": until, "pending": {"tickets": "cursor"}})
+    assert decode_sync_token(token) == {"since": since, "until": until, "pending": {"tickets": "cursor"}}
+
+
+def test_token_between_syncs_has_no_window_end():
+    since = datetime(2024, 5, 1, 12)
+    assert decode_sync_token(encode_sync_token({"since": since})) == {"since": since, "until": None, "pending": {}}
+
+
+@pytest.mark.parametrize("token", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(b'"a string"').decode(),
+    base64.urlsafe_b64encode(b'{"since": "yesterday"}').decode(),
+    base64.urlsafe_b64encode(b'{"since": "2024-05-01T12:00:00", "pending": 5}').decode(),
+])
+def test_invalid_token_is_400(token):
+    with pytest.raises(HTTPException) as error:
+        decode_sync_token(token)
+    assert error.value.status_code == 400
+
+
+def test_token_older_than_tombstone_retention_is_410():
+    since = datetime.utcnow() - timedelta(days=server.TOMBSTONE_RETENTION_DAYS, minutes=1)
+    with pytest.raises(HTTPException) as error:
+        sync(encode_sync_token({"since": since}))
+    assert error.value.status_code == 410
+
+
+def test_token_inside_tombstone_retention_is_accepted():
+    since = datetime.utcnow() - timedelta(days=server.TOMBSTONE_RETENTION_DAYS, minutes=-1)
+    assert sync(encode_sync_token({"since": since}))["has_more"] is False
+
+
+def test_delta_sync_returns_only_changes_and_deletions():
+    hour_ago = datetime.utcnow() - timedelta(hours=1)
+    asyncio.run(db.equipment.insert_many([
+        equipment("old", hour_ago),
+        equipment("gone", hour_ago, deleted_at=hour_ago),
+    ]))
+    first = sync()
+    assert [e["id"] for e in first["equipment"]] == ["old"]
+    assert first["deleted"] == {"equipment": [], "tickets": []}
+
+    asyncio.run(db.equipment.insert_one(equipment("new", datetime.utcnow())))
+    asyncio.run(server.record_tombstone("equipment", "old"))
+    second = sync(first["sync_token"])
+    assert [e["id"] for e in second["equipment"]] == ["new"]
+    assert second["deleted"]["equipment"] == ["old"]
+
+
+def test_large_change_sets_come_back_in_batches(monkeypatch):
+    monkeypatch.setattr(server, "SYNC_BATCH_SIZE", 2)
+    hour_ago = datetime.utcnow() - timedelta(hours=1)
+    asyncio.run(db.equipment.insert_many([equipment(f"e{i}", hour_ago + timedelta(seconds=i)) for i in range(5)]))
+
+    seen, token = [], None
+    while True:
+        page = sync(token)
+        seen.extend(e["id"] for e in page["equipment"])
+        token = page["sync_token"]
+        if not page["has_more"]:
+            break
+    assert seen == [f"e{i}" for i in range(5)]
+    # Changes made while batching are picked up by the next window, not lost
+    assert decode_sync_token(token)["since"] > hour_ago + timedelta(seconds=4)
+
+
+def test_users_only_sync_their_own_tickets_and_tombstones():
+    now = datetime.utcnow()
+    asyncio.run(db.tickets.insert_many([
+        {"id": "mine", "equipment_id": "e", "title": "t", "description": "d", "created_by": "user", "created_at": now, "updated_at": now},
+        {"id": "theirs", "equipment_id": "e", "title": "t", "description": "d", "created_by": "other", "created_at": now, "updated_at": now},
+    ]))
+    assert [t["id"] for t in sync(principal=USER)["tickets"]] == ["mine"]
+
+    token = encode_sync_token({"since": now - timedelta(minutes=1)})
+    asyncio.run(server.record_tombstones("tickets", [("mine", "user"), ("theirs", "other")]))
+    assert sync(token, principal=USER)["deleted"]["tickets"] == ["mine"]
+    assert sorted(sync(token)["deleted"]["tickets"]) == ["mine", "theirs"]
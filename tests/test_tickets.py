@@ -0,0 +1,35 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import parse_if_match  # noqa: E402
+
+
+@pytest.mark.parametrize("if_match", [None, "*", " * "])
+def test_no_precondition(if_match):
+    assert parse_if_match(if_match) is None
+
+
+@pytest.mark.parametrize("if_match, version", [
+    ('"3"', 3),
+    ("3", 3),
+    ('W/"3"', 3),
+    (' "12" ', 12),
+    ('"0"', 0),
+])
+def test_parses_version_etags(if_match, version):
+    assert parse_if_match(if_match) == version
+
+
+@pytest.mark.parametrize("if_match", ['"abc"', '"3", "4"', "", 'W/""'])
+def test_unparseable_etag_fails_the_precondition(if_match):
+    with pytest.raises(HTTPException) as error:
+        parse_if_match(if_match)
+    assert error.value.status_code == 412